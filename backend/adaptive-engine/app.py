@@ -1,17 +1,39 @@
 from flask import Flask, request, jsonify
 import redis
-import random
 import requests
 import json
+import logging
+import os
 import time
 
+from content_catalog import ContentCatalog
+from item_similarity import QUIZ_ITEM_PREFIX, ItemNeighbors
+from tasks import build_item_neighbors
+from mastery import LEVELS, levels_for, mastery_key, parse_mastery, read_mastery
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
-# Connect to Redis server
-r = redis.Redis(host='localhost', port=6379, decode_responses=True)
+# Connect to Redis server, the same one the mastery consumer and the CF worker use
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
 # URL of Content Service
-CONTENT_SERVICE_URL = "http://localhost:5001/get-content"
+CONTENT_SERVICE_URL = os.getenv("CONTENT_SERVICE_URL", "http://localhost:5001")
+CONTENT_SYNC_INTERVAL = int(os.getenv("CONTENT_SYNC_INTERVAL", 30))
+# Versions re-read by every sync, so writes that commit out of version order are not missed
+CONTENT_SYNC_OVERLAP = int(os.getenv("CONTENT_SYNC_OVERLAP", 100))
+MAX_BATCH_RECOMMENDATIONS = 500
+
+# Local copy of the content catalog, so recommending makes no calls to the content service
+catalog = ContentCatalog(CONTENT_SERVICE_URL, r, sync_interval=CONTENT_SYNC_INTERVAL,
+                         sync_overlap=CONTENT_SYNC_OVERLAP)
+
+# Item-to-item neighbours built offline by tasks.build_item_neighbors, memory-mapped
+item_neighbors = ItemNeighbors()
 
 @app.route('/')
 def home():
@@ -48,35 +70,37 @@ def recommend():
     difficulty = data.get("difficulty")
     subject = data.get("subject", "Mathematics")  # Default to Mathematics if subject is not provided
 
-    # Determine the next level based on the score and current difficulty
-    next_level = determine_next_level(score, difficulty)
-
     try:
-        # Call Content Service to get content based on the subject and next level
-        response = requests.get(CONTENT_SERVICE_URL, params={"subject": subject, "level": next_level})
-        print(f"Content service response status: {response.status_code}")
-        print(f"Content service response body: {response.text}")
-        content = response.json()
-        print(f"Parsed content: {content}, Type: {type(content)}, Length: {len(content) if isinstance(content, list) else 'N/A'}")
-
-        if content:
-            selected = random.choice(content)
-
-            # Store the recommended content in Redis for 1 hour
-            r.setex(username, 3600, json.dumps(selected))
-
-            # Store user's learning history (last 10 items)
-            entry = {
-                "timestamp": int(time.time()),
-                "content": selected
-            }
-            r.rpush(f"history:{username}", json.dumps(entry))
-            r.ltrim(f"history:{username}", -10, -1)  # Keep only the last 10 items
+        pipe = r.pipeline(transaction=False)
+        pipe.hmget(mastery_key(subject), [username])
+        pipe.lrange(f"history:{username}", 0, -1)
+        mastery_reply, history = pipe.execute()
+
+        # Students with a mastery estimate get the level it points to; otherwise
+        # step the ladder from this score
+        mastery, known = parse_mastery(mastery_reply)
+        if known[0]:
+            next_level = LEVELS[levels_for(mastery)[0]]
+        else:
+            next_level = determine_next_level(score, difficulty)
+
+        catalog.start()
+        if not catalog.loaded:
+            # First request before the background sync finished: load the catalog now
+            catalog.sync()
+
+        selected = choose_content(subject, next_level, history, data.get("quizId"))
+        if selected:
+            # Store the recommendation for 1 hour and the last 10 in the learning history
+            pipe = r.pipeline(transaction=False)
+            store_recommendation(pipe, username, selected, int(time.time()))
+            pipe.execute()
 
             return jsonify({"next_content": selected})
         else:
             return jsonify({"error": "No content found for this level"}), 404
     except requests.exceptions.RequestException as e:
+        logger.error(f"Could not load the content catalog: {str(e)}")
         # Handle errors from Content Service
         return jsonify({"error": f"Error contacting Content Service: {str(e)}"}), 503
     except redis.exceptions.ConnectionError as e:
@@ -86,6 +110,159 @@ def recommend():
         # Handle other exceptions
         return jsonify({"error": str(e)}), 500
 
+# Mastery and recommended level for a whole class in one subject
+@app.route('/mastery/class', methods=['POST'])
+def class_mastery():
+    data = request.json or {}
+    subject = data.get("subject")
+    usernames = data.get("usernames")
+    if not subject or not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+        return jsonify({"error": "subject and a list of usernames are required"}), 400
+
+    try:
+        mastery, known = read_mastery(r, subject, usernames)
+    except redis.exceptions.ConnectionError as e:
+        return jsonify({"error": f"Error connecting to Redis: {str(e)}"}), 500
+
+    levels = levels_for(mastery)
+    students = [
+        {"username": name, "mastery": round(float(value), 4), "level": LEVELS[level], "known": bool(has_mastery)}
+        for name, value, level, has_mastery in zip(usernames, mastery, levels, known)
+    ]
+    return jsonify({
+        "subject": subject,
+        "students": students,
+        "summary": {
+            "mean_mastery": round(float(mastery[known].mean()), 4) if known.any() else None,
+            "levels": dict(zip(LEVELS, np.bincount(levels, minlength=len(LEVELS)).tolist())),
+            "unknown": int((~known).sum()),
+        },
+    })
+
+# State of the local content catalog
+@app.route('/catalog-status', methods=['GET'])
+def catalog_status():
+    return jsonify(catalog.stats())
+
+def choose_content(subject, level, history, quiz_id=None):
+    """
+    The catalog item at this subject and level most similar to what the student
+    has already seen (and the quiz just taken, if given), or a random one when
+    there is nothing to go on
+    """
+    seen = set()
+    for raw in history:
+        content_id = (json.loads(raw).get("content") or {}).get("_id")
+        if content_id:
+            seen.add(content_id)
+    seeds = list(seen) + ([QUIZ_ITEM_PREFIX + quiz_id] if quiz_id else [])
+
+    def accept(content_id):
+        item = catalog.get(content_id)
+        return (item is not None and content_id not in seen
+                and item.get("subject") == subject and item.get("level") == level)
+
+    similar = item_neighbors.recommend(seeds, accept) if seeds else None
+    return catalog.get(similar) if similar else catalog.choose(subject, level)
+
+def store_recommendation(pipe, username, selected, timestamp):
+    """Queue the last-recommendation and history writes for one user"""
+    entry = {
+        "timestamp": timestamp,
+        "content": selected
+    }
+    pipe.setex(username, 3600, json.dumps(selected))
+    pipe.rpush(f"history:{username}", json.dumps(entry))
+    pipe.ltrim(f"history:{username}", -10, -1)
+
+# Recommendations for a whole class: mastery and histories are read with one
+# pipelined round trip, content is picked from the local catalog, and every
+# recommendation and history entry is written with a second one
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_batch():
+    data = request.json or {}
+    students = data.get("students")
+    if not isinstance(students, list) or not students:
+        return jsonify({"error": "students must be a non-empty list"}), 400
+    if len(students) > MAX_BATCH_RECOMMENDATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_RECOMMENDATIONS} students per batch"}), 413
+
+    results = [None] * len(students)
+    by_subject = {}
+    for i, student in enumerate(students):
+        username = student.get("username") if isinstance(student, dict) else None
+        if not username:
+            results[i] = {"error": "username is required"}
+            continue
+        try:
+            score = int(student.get("score"))
+        except (ValueError, TypeError):
+            results[i] = {"username": username, "error": "Score must be a valid number"}
+            continue
+        subject = student.get("subject", "Mathematics")
+        by_subject.setdefault(subject, []).append((i, username, score, student.get("difficulty")))
+
+    try:
+        catalog.start()
+        if not catalog.loaded:
+            catalog.sync()
+
+        subjects = list(by_subject)
+        queued = [entry for subject in subjects for entry in by_subject[subject]]
+        pipe = r.pipeline(transaction=False)
+        for subject in subjects:
+            pipe.hmget(mastery_key(subject), [username for _, username, _, _ in by_subject[subject]])
+        for _, username, _, _ in queued:
+            pipe.lrange(f"history:{username}", 0, -1)
+        replies = pipe.execute() if subjects else []
+        histories = {entry[0]: history for entry, history in zip(queued, replies[len(subjects):])}
+
+        timestamp = int(time.time())
+        pipe = r.pipeline(transaction=False)
+        for subject, reply in zip(subjects, replies[:len(subjects)]):
+            mastery, known = parse_mastery(reply)
+            levels = levels_for(mastery)
+            for (i, username, score, difficulty), level, has_mastery in zip(by_subject[subject], levels, known):
+                try:
+                    next_level = LEVELS[level] if has_mastery else determine_next_level(score, difficulty)
+                except ValueError:
+                    results[i] = {"username": username, "error": f"Unknown difficulty: {difficulty}"}
+                    continue
+                selected = choose_content(subject, next_level, histories[i], students[i].get("quizId"))
+                if not selected:
+                    results[i] = {"username": username, "error": "No content found for this level"}
+                    continue
+                store_recommendation(pipe, username, selected, timestamp)
+                results[i] = {"username": username, "next_content": selected}
+        pipe.execute()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Could not load the content catalog: {str(e)}")
+        return jsonify({"error": f"Error contacting Content Service: {str(e)}"}), 503
+    except redis.exceptions.ConnectionError as e:
+        return jsonify({"error": f"Error connecting to Redis: {str(e)}"}), 500
+
+    recommended = sum(1 for result in results if "next_content" in result)
+    return jsonify({"recommended": recommended, "failed": len(results) - recommended, "results": results})
+
+# Rebuild the item neighbours now instead of waiting for the nightly run
+@app.route('/build-item-neighbors', methods=['POST'])
+def trigger_item_neighbors():
+    try:
+        task = build_item_neighbors.apply_async()
+        logger.info(f"Submitted item neighbour build {task.id}")
+        return jsonify({"task_id": task.id, "status": "Processing"}), 202
+    except Exception as e:
+        logger.error(f"Error submitting item neighbour build: {str(e)}")
+        return jsonify({"error": "Failed to submit item neighbour build"}), 500
+
+# The item neighbour build being served, if any
+@app.route('/item-neighbors-status', methods=['GET'])
+def item_neighbors_status():
+    item_neighbors.maybe_reload()
+    if not item_neighbors.manifest:
+        return jsonify({"message": "No item neighbours built yet, recommendations are random"}), 404
+    return jsonify(item_neighbors.manifest)
+
 @app.route('/last-recommendation/<username>', methods=['GET'])
 def last_recommendation(username):
     last = r.get(username)
@@ -104,4 +281,5 @@ def learning_history(username):
     return jsonify({"history": history})
 
 if __name__ == '__main__':
+    catalog.start()
     app.run(host='0.0.0.0', port=5002, debug=True)
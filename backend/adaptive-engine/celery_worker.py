@@ -0,0 +1,40 @@
+import os
+from celery import Celery
+from celery.schedules import crontab
+from kombu import Queue
+
+# The adaptive engine uses its own Redis database so its queue never mixes with other services
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/2")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/2")
+
+ADAPTIVE_QUEUE = "adaptive"
+# Hour (UTC) of the nightly item neighbour rebuild, run by celery beat
+CF_BUILD_HOUR = int(os.getenv("CF_BUILD_HOUR", 3))
+
+celery = Celery(
+    'adaptive_tasks',
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
+)
+
+celery.conf.update(
+    task_serializer='json',
+    accept_content=['json'],
+    result_serializer='json',
+    task_track_started=True,
+    task_ignore_result=False,
+    worker_prefetch_multiplier=1,
+    task_queues=(Queue(ADAPTIVE_QUEUE),),
+    task_default_queue=ADAPTIVE_QUEUE,
+    task_routes={
+        'tasks.build_item_neighbors': {'queue': ADAPTIVE_QUEUE},
+    },
+    beat_schedule={
+        'build-item-neighbors': {
+            'task': 'tasks.build_item_neighbors',
+            'schedule': crontab(hour=CF_BUILD_HOUR, minute=0),
+        },
+    },
+)
+
+import tasks
@@ -0,0 +1,165 @@
+"""
+In-memory copy of the content catalog, indexed by (subject, level), so a
+recommendation never has to call the content service.
+
+The catalog is loaded once with a full sync and then kept current two ways:
+
+  - a background thread asks the content service for everything written since
+    the last version it saw (/content-changes?since=<version>) every
+    CONTENT_SYNC_INTERVAL seconds. Versions are taken before the write commits,
+    so a lower version can appear after a higher one; each sync re-reads the
+    last CONTENT_SYNC_OVERLAP versions to pick such late writes up
+  - a second thread listens on the content_changed channel published by the quiz
+    service's cache invalidator, and refetches (or drops) a changed item as soon
+    as it changes, including writes made directly in MongoDB
+
+If the content service is down the last loaded catalog keeps being served.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CONTENT_CHANGED_CHANNEL = "content_changed"
+REQUEST_TIMEOUT = 5
+RETRY_DELAY = 5
+
+class ContentCatalog:
+    def __init__(self, content_service_url, redis_conn, sync_interval=30, sync_overlap=100):
+        self.url = content_service_url.rstrip("/")
+        self.redis = redis_conn
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.version = 0
+        self.loaded = False
+        self._items = {}     # content id -> item
+        self._by_key = {}    # (subject, level) -> {content id: item}
+        self._choices = {}   # (subject, level) -> tuple of items, for random.choice
+        self._lock = threading.Lock()
+        self._started = False
+
+    def choose(self, subject, level):
+        """A random item for the subject and level, or None if there is none"""
+        choices = self._choices.get((subject, level))
+        return random.choice(choices) if choices else None
+
+    def get(self, content_id):
+        return self._items.get(content_id)
+
+    def items(self, subject, level):
+        return list(self._choices.get((subject, level), ()))
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "version": self.version,
+            "items": len(self._items),
+            "keys": len(self._choices),
+        }
+
+    def _refresh_key(self, key):
+        items = self._by_key.get(key)
+        if items:
+            self._choices[key] = tuple(items.values())
+        else:
+            self._by_key.pop(key, None)
+            self._choices.pop(key, None)
+
+    def _remove_locked(self, content_id):
+        old = self._items.pop(content_id, None)
+        if old is None:
+            return None
+        key = (old.get("subject"), old.get("level"))
+        self._by_key.get(key, {}).pop(content_id, None)
+        return key
+
+    def upsert(self, item):
+        with self._lock:
+            content_id = item["_id"]
+            current = self._items.get(content_id)
+            if current is not None and current.get("version", 0) > item.get("version", 0):
+                return  # a slower sync response carrying an older copy
+            touched = {self._remove_locked(content_id)}
+            key = (item.get("subject"), item.get("level"))
+            self._items[content_id] = item
+            self._by_key.setdefault(key, {})[content_id] = item
+            touched.add(key)
+            for touched_key in touched - {None}:
+                self._refresh_key(touched_key)
+
+    def remove(self, content_id):
+        with self._lock:
+            key = self._remove_locked(content_id)
+            if key is not None:
+                self._refresh_key(key)
+
+    def sync(self):
+        """Fetch everything changed since the last version seen; a first sync loads the whole catalog"""
+        previous = self.version
+        # Items already held are re-read from the overlap; upsert makes that harmless
+        since = max(previous - self.sync_overlap, 0) if previous else 0
+        response = requests.get(f"{self.url}/content-changes", params={"since": since}, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        changes = response.json()
+        # Only a sync moves the version forward, so an item refetched early from a
+        # notification never makes the sync skip older changes
+        for item in changes["items"]:
+            self.upsert(item)
+        with self._lock:
+            self.version = max(self.version, changes["version"])
+            self.loaded = True
+        changed = [item for item in changes["items"] if not previous or item.get("version", 0) > previous]
+        if changed:
+            logger.info(f"Synced {len(changed)} content items, catalog at version {self.version}")
+
+    def refetch(self, content_id):
+        response = requests.get(f"{self.url}/content/{content_id}", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
+            self.remove(content_id)
+            return
+        response.raise_for_status()
+        self.upsert(response.json())
+
+    def handle_notification(self, message):
+        event = json.loads(message["data"])
+        if event["operation"] == "delete":
+            self.remove(event["contentId"])
+        else:
+            self.refetch(event["contentId"])
+
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Content sync failed: {str(e)}")
+            time.sleep(self.sync_interval if self.loaded else RETRY_DELAY)
+
+    def _listen_loop(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CONTENT_CHANGED_CHANNEL)
+                for message in pubsub.listen():
+                    try:
+                        self.handle_notification(message)
+                    except Exception as e:
+                        # The next delta sync still picks the change up if it went through the content service
+                        logger.error(f"Could not apply content change {message.get('data')}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Content change subscription failed: {str(e)}")
+            time.sleep(RETRY_DELAY)
+
+    def start(self):
+        """Start the sync and notification threads once per process"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._sync_loop, name="content-sync", daemon=True).start()
+        threading.Thread(target=self._listen_loop, name="content-notifications", daemon=True).start()
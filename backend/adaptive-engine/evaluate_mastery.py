@@ -0,0 +1,118 @@
+"""
+Offline evaluation of the mastery model against historical quiz_results.
+
+Every student's results in a subject are replayed in order. Before each quiz
+the model predicts the chance of answering a question right; the prediction is
+scored against the quiz's actual answers, then the quiz is applied. All
+students are replayed together, one attempt number at a time, so the replay is
+a few vector operations per round whatever the size of the history.
+
+    MONGO_URI=mongodb://localhost:27017/ python evaluate_mastery.py [--grid]
+
+Reports per-question Brier score and log loss for BKT and for a baseline that
+predicts each student's smoothed hit rate so far. --grid also searches a coarse
+parameter grid and reports the best parameters found.
+"""
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+from pymongo import MongoClient
+
+from mastery import DEFAULT_PARAMS, BKTParams, bkt_update, predict_correct
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+EPSILON = 1e-6
+
+GRID = {
+    "p_init": (0.2, 0.3, 0.5),
+    "p_learn": (0.05, 0.1, 0.15, 0.2, 0.3),
+    "p_slip": (0.05, 0.1, 0.15),
+    "p_guess": (0.1, 0.2, 0.25),
+}
+
+def load_sequences(db):
+    """
+    Results grouped into one sequence per (username, subject), oldest first, as
+    two (sequences x longest sequence) arrays of correct and question counts
+    plus the length of each sequence.
+    """
+    sequences = {}
+    cursor = db["quiz_results"].find(
+        {"totalQuestions": {"$gt": 0}},
+        {"_id": 0, "username": 1, "subject": 1, "correctCount": 1, "totalQuestions": 1}
+    ).sort("completedAt", 1)
+    for result in cursor:
+        key = (result.get("username"), result.get("subject"))
+        sequences.setdefault(key, []).append((result["correctCount"], result["totalQuestions"]))
+
+    lengths = np.array([len(attempts) for attempts in sequences.values()], dtype=np.int64)
+    longest = int(lengths.max(initial=0))
+    correct = np.zeros((len(sequences), longest))
+    total = np.zeros((len(sequences), longest))
+    for row, attempts in enumerate(sequences.values()):
+        correct[row, :len(attempts)], total[row, :len(attempts)] = zip(*attempts)
+    return correct, total, lengths
+
+def score_predictions(predicted, correct, total):
+    """Summed per-question Brier score and log loss of predicting `predicted` for every question"""
+    predicted = np.clip(predicted, EPSILON, 1 - EPSILON)
+    wrong = total - correct
+    brier = correct * (1 - predicted) ** 2 + wrong * predicted ** 2
+    log_loss = -(correct * np.log(predicted) + wrong * np.log(1 - predicted))
+    return brier.sum(), log_loss.sum()
+
+def evaluate(correct, total, lengths, params=DEFAULT_PARAMS):
+    mastery = np.full(len(lengths), params.p_init)
+    seen_correct = np.zeros(len(lengths))
+    seen_total = np.zeros(len(lengths))
+    totals = {"bkt": np.zeros(2), "baseline": np.zeros(2)}
+
+    for attempt in range(correct.shape[1]):
+        active = np.flatnonzero(lengths > attempt)
+        c, n = correct[active, attempt], total[active, attempt]
+        totals["bkt"] += score_predictions(predict_correct(mastery[active], params), c, n)
+        baseline = (seen_correct[active] + 1) / (seen_total[active] + 2)
+        totals["baseline"] += score_predictions(baseline, c, n)
+
+        mastery[active] = bkt_update(mastery[active], c, n, params)
+        seen_correct[active] += c
+        seen_total[active] += n
+
+    questions = total.sum()
+    return {
+        "sequences": int(len(lengths)),
+        "quizzes": int(lengths.sum()),
+        "questions": int(questions),
+        **{model: {"brier": round(float(brier / questions), 4), "log_loss": round(float(loss / questions), 4)}
+           for model, (brier, loss) in totals.items()},
+    }
+
+def grid_search(correct, total, lengths):
+    best = None
+    for values in itertools.product(*GRID.values()):
+        params = BKTParams(**dict(zip(GRID, values)))
+        report = evaluate(correct, total, lengths, params)
+        if best is None or report["bkt"]["log_loss"] < best[1]["bkt"]["log_loss"]:
+            best = (params, report)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate the mastery model on historical quiz results")
+    for field in BKTParams._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", type=float, default=getattr(DEFAULT_PARAMS, field))
+    parser.add_argument("--grid", action="store_true", help="also search a coarse grid of parameters")
+    args = parser.parse_args()
+
+    correct, total, lengths = load_sequences(MongoClient(MONGO_URI)["adaptive_lms"])
+    if not len(lengths):
+        parser.exit(message="No quiz results to evaluate\n")
+
+    params = BKTParams(**{field: getattr(args, field) for field in BKTParams._fields})
+    output = {"params": params._asdict(), "report": evaluate(correct, total, lengths, params)}
+    if args.grid:
+        best_params, best_report = grid_search(correct, total, lengths)
+        output["best"] = {"params": best_params._asdict(), "report": best_report}
+    print(json.dumps(output, indent=2))
@@ -0,0 +1,196 @@
+"""
+Item-to-item collaborative filtering over learning histories and quiz results.
+
+Every student's interactions (content in history:<username>, plus each quiz they
+took as "quiz:<quizId>") form a binary user x item matrix. Item similarity is
+the cosine between item columns, computed from the sparse co-occurrence counts:
+
+    similarity(i, j) = users with both / sqrt(users with i * users with j)
+
+Only the top CF_TOP_K content neighbours of every item are kept, in a build
+directory under CF_DIR:
+
+    item_ids.json    item id of each row
+    neighbors.npy    int32 [items x K], row index of each neighbour, -1 past the end
+    scores.npy       float32 [items x K], similarity of each neighbour, descending
+    manifest.json    build time, sizes and parameters
+
+CF_DIR/current.json names the build being served and is replaced atomically
+when a new build finishes. The adaptive engine memory-maps the arrays, so
+serving reads K entries per seed item and the arrays are shared by every
+process on the host.
+"""
+import datetime
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CF_DIR = os.getenv("CF_DIR", "cf_model")
+CF_TOP_K = int(os.getenv("CF_TOP_K", 20))
+# Pairs seen together by fewer students than this are treated as noise
+CF_MIN_SUPPORT = int(os.getenv("CF_MIN_SUPPORT", 2))
+CF_KEEP_BUILDS = 2
+QUIZ_ITEM_PREFIX = "quiz:"
+HISTORY_SCAN_BATCH = 500
+
+def load_interactions(redis_conn, db):
+    """username -> set of item ids, from the Redis learning histories and quiz_results"""
+    interactions = {}
+    keys = list(redis_conn.scan_iter(match="history:*", count=1000))
+    for start in range(0, len(keys), HISTORY_SCAN_BATCH):
+        batch = keys[start:start + HISTORY_SCAN_BATCH]
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in batch:
+            pipe.lrange(key, 0, -1)
+        for key, entries in zip(batch, pipe.execute()):
+            username = key.split(":", 1)[1]
+            for raw in entries:
+                content_id = (json.loads(raw).get("content") or {}).get("_id")
+                if content_id:
+                    interactions.setdefault(username, set()).add(content_id)
+
+    for result in db["quiz_results"].find({"quizId": {"$exists": True}}, {"_id": 0, "username": 1, "quizId": 1}):
+        if result.get("username"):
+            interactions.setdefault(result["username"], set()).add(QUIZ_ITEM_PREFIX + result["quizId"])
+    return interactions
+
+def top_k_neighbors(interactions, k=CF_TOP_K, min_support=CF_MIN_SUPPORT):
+    """(item_ids, neighbors, scores) with the top k content neighbours of every item"""
+    item_ids = sorted({item for items in interactions.values() for item in items})
+    index = {item: i for i, item in enumerate(item_ids)}
+    n = len(item_ids)
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if n == 0:
+        return item_ids, neighbors, scores
+
+    # Only content is ever recommended, so pairs are formed against content columns
+    # alone: a user with q quizzes and c content items costs (q + c) x c pairs
+    is_content = np.array([not item.startswith(QUIZ_ITEM_PREFIX) for item in item_ids])
+    degree = np.zeros(n, dtype=np.int64)
+    pair_codes = []
+    for items in interactions.values():
+        rows = np.fromiter((index[item] for item in items), dtype=np.int64, count=len(items))
+        degree[rows] += 1
+        content = rows[is_content[rows]]
+        if len(rows) > 1 and len(content):
+            a, b = np.meshgrid(rows, content, indexing="ij")
+            off_diagonal = a != b
+            pair_codes.append(a[off_diagonal] * n + b[off_diagonal])
+    if not pair_codes:
+        return item_ids, neighbors, scores
+
+    # Sparse co-occurrence as (row, column, count) triples
+    codes, support = np.unique(np.concatenate(pair_codes), return_counts=True)
+    rows, cols = np.divmod(codes, n)
+    keep = support >= min_support
+    rows, cols, support = rows[keep], cols[keep], support[keep]
+    similarity = support / np.sqrt(degree[rows] * degree[cols])
+
+    # Sort by row, best first within each row, and keep the first k of every row
+    order = np.lexsort((-similarity, rows))
+    rows, cols, similarity = rows[order], cols[order], similarity[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    top = rank < k
+    neighbors[rows[top], rank[top]] = cols[top]
+    scores[rows[top], rank[top]] = similarity[top]
+    return item_ids, neighbors, scores
+
+def write_build(item_ids, neighbors, scores, cf_dir=CF_DIR, users=0):
+    """Write a build and point current.json at it; returns its manifest"""
+    build_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    directory = os.path.join(cf_dir, build_id)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "neighbors.npy"), neighbors)
+    np.save(os.path.join(directory, "scores.npy"), scores)
+    with open(os.path.join(directory, "item_ids.json"), "w") as f:
+        json.dump(item_ids, f)
+    manifest = {
+        "build": build_id,
+        "builtAt": datetime.datetime.utcnow().isoformat(),
+        "items": len(item_ids),
+        "users": users,
+        "k": int(neighbors.shape[1]),
+        "minSupport": CF_MIN_SUPPORT,
+        "pairs": int((neighbors >= 0).sum()),
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    current = os.path.join(cf_dir, "current.json")
+    with open(current + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(current + ".tmp", current)
+
+    # Older builds go once they can no longer be current; processes that still
+    # have them mapped keep reading the unlinked files until they reload
+    builds = sorted(name for name in os.listdir(cf_dir) if os.path.isdir(os.path.join(cf_dir, name)))
+    for name in builds[:-CF_KEEP_BUILDS]:
+        shutil.rmtree(os.path.join(cf_dir, name), ignore_errors=True)
+    return manifest
+
+class ItemNeighbors:
+    """Memory-mapped view of the current build, reloaded when a new one is published"""
+
+    def __init__(self, cf_dir=CF_DIR, check_interval=60):
+        self.cf_dir = cf_dir
+        self.check_interval = check_interval
+        self.manifest = None
+        self._index = {}
+        self._item_ids = []
+        self._neighbors = None
+        self._scores = None
+        self._next_check = 0
+
+    def maybe_reload(self):
+        if time.time() < self._next_check:
+            return
+        self._next_check = time.time() + self.check_interval
+        try:
+            with open(os.path.join(self.cf_dir, "current.json")) as f:
+                manifest = json.load(f)
+            if self.manifest and manifest["build"] == self.manifest["build"]:
+                return
+            directory = os.path.join(self.cf_dir, manifest["build"])
+            with open(os.path.join(directory, "item_ids.json")) as f:
+                item_ids = json.load(f)
+            neighbors = np.load(os.path.join(directory, "neighbors.npy"), mmap_mode="r")
+            scores = np.load(os.path.join(directory, "scores.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return  # nothing built yet
+        except Exception as e:
+            logger.error(f"Could not load item neighbours: {str(e)}")
+            return
+        self._item_ids, self._neighbors, self._scores = item_ids, neighbors, scores
+        self._index = {item: i for i, item in enumerate(item_ids)}
+        self.manifest = manifest
+        logger.info(f"Loaded item neighbours build {manifest['build']} ({manifest['items']} items)")
+
+    def recommend(self, seeds, accept):
+        """
+        The best scoring neighbour of the seed items that `accept(item_id)` allows,
+        summing similarity over seeds, or None. Costs K reads per seed.
+        """
+        self.maybe_reload()
+        if self._neighbors is None:
+            return None
+        totals = {}
+        for seed in seeds:
+            row = self._index.get(seed)
+            if row is None:
+                continue
+            for neighbor, score in zip(self._neighbors[row], self._scores[row]):
+                if neighbor < 0:
+                    break
+                totals[neighbor] = totals.get(neighbor, 0.0) + float(score)
+        for neighbor in sorted(totals, key=totals.get, reverse=True):
+            item_id = self._item_ids[neighbor]
+            if accept(item_id):
+                return item_id
+        return None
@@ -0,0 +1,100 @@
+"""
+Per-user, per-subject mastery estimated with Bayesian Knowledge Tracing.
+
+Mastery is the probability that a student knows a subject. It is kept in one
+Redis hash per subject, mastery:<subject>, with a field per username, and moved
+by every graded quiz: each question is an observation that is right with
+probability 1 - P_SLIP if the student knows the subject and P_GUESS if not,
+followed by a chance P_LEARN of learning it.
+
+Everything works on NumPy arrays, so updating or levelling a whole class costs
+the same handful of vector operations as a single student.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+BKTParams = namedtuple("BKTParams", ["p_init", "p_learn", "p_slip", "p_guess"])
+DEFAULT_PARAMS = BKTParams(p_init=0.3, p_learn=0.15, p_slip=0.1, p_guess=0.2)
+
+LEVELS = ["Beginner", "Intermediate", "Advanced"]
+# Mastery at which a student moves up to the next level
+LEVEL_THRESHOLDS = np.array([0.4, 0.8])
+
+def mastery_key(subject):
+    return f"mastery:{subject}"
+
+def predict_correct(mastery, params=DEFAULT_PARAMS):
+    """Probability of answering a question right at the given mastery"""
+    return mastery * (1 - params.p_slip) + (1 - mastery) * params.p_guess
+
+def bkt_update(prior, correct, total, params=DEFAULT_PARAMS):
+    """
+    Posterior mastery after answering `correct` of `total` questions, for arrays
+    of students at once. The order of the answers within a quiz is not recorded,
+    so each question is applied as the expected update at the quiz's hit rate.
+    """
+    mastery = np.array(prior, dtype=np.float64)
+    correct = np.asarray(correct, dtype=np.float64)
+    total = np.asarray(total, dtype=np.int64)
+    rate = np.divide(correct, total, out=np.zeros_like(mastery), where=total > 0)
+
+    for step in range(int(total.max(initial=0))):
+        p_correct = predict_correct(mastery, params)
+        if_right = mastery * (1 - params.p_slip) / p_correct
+        if_wrong = mastery * params.p_slip / (1 - p_correct)
+        posterior = rate * if_right + (1 - rate) * if_wrong
+        posterior = posterior + (1 - posterior) * params.p_learn
+        mastery = np.where(step < total, posterior, mastery)
+    return np.clip(mastery, 0.0, 1.0)
+
+def levels_for(mastery):
+    """Level index (into LEVELS) for each mastery value"""
+    return np.digitize(mastery, LEVEL_THRESHOLDS)
+
+def read_mastery(redis_conn, subject, usernames, params=DEFAULT_PARAMS):
+    """Mastery of each user with one HMGET; returns (mastery, known) arrays"""
+    if not usernames:
+        return np.zeros(0), np.zeros(0, dtype=bool)
+    return parse_mastery(redis_conn.hmget(mastery_key(subject), usernames), params)
+
+def parse_mastery(values, params=DEFAULT_PARAMS):
+    """(mastery, known) arrays from HMGET replies, for callers that pipeline the reads"""
+    known = np.array([value is not None for value in values], dtype=bool)
+    mastery = np.array([params.p_init if value is None else float(value) for value in values])
+    return mastery, known
+
+def mastery_mapping(usernames, mastery):
+    return {username: f"{value:.4f}" for username, value in zip(usernames, mastery)}
+
+def update_mastery(redis_conn, subject, usernames, correct, total, params=DEFAULT_PARAMS, pipe=None):
+    """
+    Apply quiz results for a subject and write them back with one HSET, queued on
+    `pipe` when given. A user listed more than once gets each result applied in
+    order. Reads and writes are not atomic, so run a single writer (the mastery
+    consumer).
+    """
+    order = list(dict.fromkeys(usernames))
+    mastery, _ = read_mastery(redis_conn, subject, order, params)
+    current = dict(zip(order, mastery))
+
+    # Results are applied in rounds, so each round has at most one result per user
+    remaining = list(zip(usernames, correct, total))
+    while remaining:
+        round_users, seen, deferred = [], set(), []
+        for entry in remaining:
+            if entry[0] in seen:
+                deferred.append(entry)
+            else:
+                seen.add(entry[0])
+                round_users.append(entry)
+        names = [entry[0] for entry in round_users]
+        updated = bkt_update([current[name] for name in names],
+                             [entry[1] for entry in round_users],
+                             [entry[2] for entry in round_users], params)
+        current.update(zip(names, updated))
+        remaining = deferred
+
+    mapping = mastery_mapping(order, [current[name] for name in order])
+    (pipe or redis_conn).hset(mastery_key(subject), mapping=mapping)
+    return mapping
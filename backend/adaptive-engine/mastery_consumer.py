@@ -0,0 +1,90 @@
+"""
+Updates mastery from the quiz graded events the quiz service publishes.
+
+    python mastery_consumer.py
+
+Each batch is grouped by subject and applied with one vectorized update per
+subject. The new mastery values and the XACK for the batch are written in one
+MULTI/EXEC, so a batch is either applied and acknowledged or neither: after a
+crash the consumer replays its pending events and nothing is counted twice.
+Mastery updates read before they write, so run exactly one of these.
+"""
+import logging
+import os
+import time
+
+import redis
+
+from mastery import update_mastery
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+QUIZ_GRADED_STREAM = "events:quiz_graded"
+CONSUMER_GROUP = "adaptive"
+CONSUMER_NAME = "mastery"
+BATCH_SIZE = int(os.getenv("MASTERY_BATCH_SIZE", 500))
+BLOCK_MS = 5000
+RETRY_DELAY = 5
+
+def group_by_subject(entries):
+    """subject -> (usernames, correct counts, question counts), in stream order"""
+    subjects = {}
+    for entry_id, fields in entries:
+        if not fields:
+            continue  # trimmed from the stream while pending
+        try:
+            username, subject = fields["username"], fields["subject"]
+            correct, total = int(fields["correctCount"]), int(fields["totalQuestions"])
+        except (KeyError, TypeError, ValueError):
+            # A malformed event will never succeed, so it is acknowledged and dropped
+            logger.error(f"Dropping event {entry_id}: {fields}")
+            continue
+        usernames, corrects, totals = subjects.setdefault(subject, ([], [], []))
+        usernames.append(username)
+        corrects.append(correct)
+        totals.append(total)
+    return subjects
+
+def process(redis_conn, entries):
+    if not entries:
+        return
+    pipe = redis_conn.pipeline(transaction=True)
+    for subject, (usernames, corrects, totals) in group_by_subject(entries).items():
+        update_mastery(redis_conn, subject, usernames, corrects, totals, pipe=pipe)
+    pipe.xack(QUIZ_GRADED_STREAM, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+    pipe.execute()
+    logger.info(f"Applied {len(entries)} quiz results to mastery")
+
+def run(redis_conn):
+    try:
+        # Start from the beginning of the stream so past results seed mastery
+        redis_conn.xgroup_create(QUIZ_GRADED_STREAM, CONSUMER_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    replay_pending = True  # events read before a crash or restart come first
+    while True:
+        try:
+            stream_id = "0" if replay_pending else ">"
+            response = redis_conn.xreadgroup(
+                CONSUMER_GROUP, CONSUMER_NAME, {QUIZ_GRADED_STREAM: stream_id},
+                count=BATCH_SIZE, block=None if replay_pending else BLOCK_MS
+            )
+            entries = response[0][1] if response else []
+            if replay_pending and not entries:
+                replay_pending = False
+                continue
+            process(redis_conn, entries)
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            logger.error(f"Redis unavailable: {str(e)}")
+            time.sleep(RETRY_DELAY)
+        except Exception as e:
+            logger.error(f"Error updating mastery: {str(e)}")
+            replay_pending = True
+            time.sleep(RETRY_DELAY)
+
+if __name__ == '__main__':
+    run(redis.Redis.from_url(REDIS_URL, decode_responses=True))
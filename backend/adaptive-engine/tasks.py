@@ -0,0 +1,28 @@
+from celery_worker import celery
+from item_similarity import CF_DIR, load_interactions, top_k_neighbors, write_build
+from pymongo import MongoClient
+import logging
+import os
+import redis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Offline rebuild of the item-to-item neighbours served by /recommend. Reads every
+# learning history and quiz result, so it runs on a schedule rather than per request.
+@celery.task(name='tasks.build_item_neighbors')
+def build_item_neighbors():
+    redis_conn = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    client = MongoClient(MONGO_URI)
+    try:
+        interactions = load_interactions(redis_conn, client["adaptive_lms"])
+    finally:
+        client.close()
+
+    item_ids, neighbors, scores = top_k_neighbors(interactions)
+    manifest = write_build(item_ids, neighbors, scores, CF_DIR, users=len(interactions))
+    logger.info(f"Built item neighbours {manifest['build']}: {manifest['items']} items, {manifest['pairs']} neighbour pairs")
+    return manifest
@@ -1,8 +1,20 @@
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
+from bson import ObjectId
 import datetime
-from tasks import generate_insights
+import json
+import redis
+from tasks import rebuild_summaries_task, rebuild_rollups_task, export_collections_task, broker_redis
+from celery_worker import celery, ANALYTICS_QUEUE, queue_metrics
+from summaries import SUMMARY_COLLECTION, insights_from_summary, rebuild_summaries as rebuild_user_summaries
+from cohorts import DEFAULT_AT_RISK_THRESHOLD, cohort_cache_key, get_cohort_analytics
+from ingest import BufferedWriter, ingest_records, validate_event, validate_events
+from rollups import GRANULARITIES, ROLLUP_COLLECTION, ensure_rollup_indexes, get_trends
+from export import EXPORTS
+from sketches import MAX_RANGE_DAYS, SKETCH_DIMENSIONS, sketch_summary
 import logging
+import os
+import time
 
 app = Flask(__name__)
 
@@ -11,9 +23,30 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # MongoDB connection setup
-client = MongoClient("mongodb://localhost:27017/")
+client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
 db = client["adaptive_lms"]
 collection = db["performance_data"]
+summary_collection = db[SUMMARY_COLLECTION]
+cohort_collection = db["cohorts"]
+rollup_collection = db[ROLLUP_COLLECTION]
+ensure_rollup_indexes(rollup_collection)
+# Finds the cohorts a student belongs to when their cached analytics go stale
+cohort_collection.create_index("members")
+
+# Redis for cached analytics, shared with the quiz service so its submissions can invalidate them
+cache_redis = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+
+# Single events are buffered and written in bulk unless INGEST_BUFFERED=false
+INGEST_BUFFERED = os.getenv("INGEST_BUFFERED", "true").lower() == "true"
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 0.25))
+MAX_BULK_EVENTS = 10000
+
+# Users without a summary and at most this many records get it built inline; larger
+# histories are rebuilt by a Celery task so the request stays fast
+INSIGHTS_INLINE_THRESHOLD = int(os.getenv("INSIGHTS_INLINE_THRESHOLD", 1000))
+INSIGHTS_METRICS_KEY = "analytics_metrics:insights"
+performance_writer = BufferedWriter(db, cache_redis, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL)
 
 @app.route('/')
 def home():
@@ -21,35 +54,287 @@ def home():
 
 @app.route('/submit-performance', methods=['POST'])
 def submit_performance():
-    data = request.json
-    data['timestamp'] = datetime.datetime.utcnow()
+    document, error = validate_event(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        # Insert performance data into MongoDB collection
-        collection.insert_one(data)
+        if INGEST_BUFFERED:
+            performance_writer.submit(document)
+        else:
+            failures = ingest_records(db, cache_redis, [document])
+            if failures and not failures[0]["duplicate"]:
+                return jsonify({"error": failures[0]["error"]}), 400
         return jsonify({"message": "Performance data submitted successfully"}), 200
     except Exception as e:
         # Log and return error if MongoDB insertion fails
         logger.error(f"Error submitting performance data: {str(e)}")
         return jsonify({"error": "Failed to submit performance data"}), 500
 
+# Bulk ingest: a JSON array of events, or NDJSON (one event per line). Valid events
+# are written even if others fail; errors are reported by their position in the input.
+@app.route('/submit-performance/bulk', methods=['POST'])
+def submit_performance_bulk():
+    errors = []
+    if request.is_json:
+        events = request.get_json(silent=True)
+        if not isinstance(events, list):
+            return jsonify({"error": "Body must be a JSON array of events"}), 400
+    else:
+        events = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                errors.append({"index": len(events), "error": "invalid JSON"})
+                events.append(None)
+
+    if len(events) > MAX_BULK_EVENTS:
+        return jsonify({"error": f"At most {MAX_BULK_EVENTS} events per request"}), 413
+
+    documents, indexes, validation_errors = validate_events(events)
+    parsed = {error["index"] for error in errors}
+    errors.extend(error for error in validation_errors if error["index"] not in parsed)
+
+    duplicates = 0
+    try:
+        for failure in ingest_records(db, cache_redis, documents):
+            if failure["duplicate"]:
+                # Already stored by an earlier attempt of a retried request
+                duplicates += 1
+            else:
+                errors.append({"index": indexes[failure["position"]], "error": failure["error"]})
+    except Exception as e:
+        logger.error(f"Error ingesting performance events: {str(e)}")
+        return jsonify({"error": "Failed to submit performance data"}), 500
+
+    errors.sort(key=lambda error: error["index"])
+    return jsonify({
+        "received": len(events),
+        "inserted": len(events) - len(errors) - duplicates,
+        "duplicates": duplicates,
+        "errors": errors
+    }), 200
+
+# Insights are read from the user's materialized summary, one entry per subject
 @app.route('/insights/<username>', methods=['GET'])
 def insights(username):
+    started = time.time()
+    try:
+        summary = summary_collection.find_one({"_id": username})
+        if summary:
+            result = insights_from_summary(summary)
+            if result is None:
+                record_insights_path("not_found", started)
+                return jsonify({"error": "No performance data found"}), 404
+            record_insights_path("summary", started)
+            return jsonify({"status": "Completed", "result": result}), 200
+
+        # Data from before summaries existed. Counting stops past the threshold, so
+        # deciding costs at most INSIGHTS_INLINE_THRESHOLD index entries.
+        records = collection.count_documents({"username": username}, limit=INSIGHTS_INLINE_THRESHOLD + 1)
+        if not records:
+            record_insights_path("not_found", started)
+            return jsonify({"error": "No performance data found"}), 404
+
+        if records <= INSIGHTS_INLINE_THRESHOLD:
+            rebuild_user_summaries(db, username)
+            result = insights_from_summary(summary_collection.find_one({"_id": username}) or {})
+            if result is None:
+                record_insights_path("not_found", started)
+                return jsonify({"error": "No performance data found"}), 404
+            record_insights_path("inline", started)
+            return jsonify({"status": "Completed", "result": result}), 200
+
+        task = rebuild_summaries_task.apply_async(kwargs={"username": username, "enqueued_at": time.time()})
+        logger.info(f"No summary for {username}, submitted rebuild task {task.id}")
+        record_insights_path("async", started)
+        return jsonify({"task_id": task.id, "status": "Processing"}), 202
+    except Exception as e:
+        logger.error(f"Error generating insights for {username}: {str(e)}")
+        return jsonify({"error": "Failed to generate insights"}), 500
+
+def record_insights_path(path, started):
+    """Count which path served an insights request and how long it took"""
     try:
-        # Trigger the Celery task to generate insights
-        task = generate_insights.delay(username)
-        logger.info(f"Submitted task for {username}, task_id: {task.id}")
+        pipe = cache_redis.pipeline(transaction=False)
+        pipe.hincrby(INSIGHTS_METRICS_KEY, f"{path}:count", 1)
+        pipe.hincrbyfloat(INSIGHTS_METRICS_KEY, f"{path}:seconds", time.time() - started)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Error recording insights metrics: {str(e)}")
+
+# How insights requests were served: from the summary, built inline, or sent to Celery
+@app.route('/insights-metrics', methods=['GET'])
+def insights_metrics():
+    try:
+        raw = {key.decode(): float(value) for key, value in cache_redis.hgetall(INSIGHTS_METRICS_KEY).items()}
+        paths = {}
+        for path in ("summary", "inline", "async", "not_found"):
+            count = int(raw.get(f"{path}:count", 0))
+            seconds = raw.get(f"{path}:seconds", 0.0)
+            paths[path] = {"count": count, "avg_ms": round(seconds / count * 1000, 2) if count else 0.0}
+        return jsonify({"inline_threshold": INSIGHTS_INLINE_THRESHOLD, "paths": paths}), 200
+    except Exception as e:
+        logger.error(f"Error reading insights metrics: {str(e)}")
+        return jsonify({"error": "Failed to read insights metrics"}), 500
+
+# Rebuild summaries from performance_data, for one user ({"username": ...}) or everyone
+@app.route('/rebuild-summaries', methods=['POST'])
+def rebuild_summaries():
+    username = (request.get_json(silent=True) or {}).get("username")
+    try:
+        task = rebuild_summaries_task.apply_async(kwargs={"username": username, "enqueued_at": time.time()})
+        logger.info(f"Submitted summary rebuild for {username or 'all users'}, task_id: {task.id}")
         return jsonify({"task_id": task.id, "status": "Processing"}), 202
     except Exception as e:
-        # Handle any errors that occur while submitting the task
-        logger.error(f"Error submitting task for {username}: {str(e)}")
+        logger.error(f"Error submitting summary rebuild: {str(e)}")
         return jsonify({"error": "Failed to submit task"}), 500
 
+# Trends read from the rollups: ?granularity=hour|day|week (default week), optional
+# ?subject=, ?from=/&to= (ISO dates) or ?limit= most recent buckets (default 12)
+@app.route('/trends/<username>', methods=['GET'])
+def trends(username):
+    granularity = request.args.get("granularity", "week")
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {', '.join(GRANULARITIES)}"}), 400
+    try:
+        start = datetime.datetime.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        end = datetime.datetime.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"error": "from and to must be ISO 8601 dates"}), 400
+    limit = min(max(request.args.get("limit", 12, type=int), 1), 500)
+
+    try:
+        result = get_trends(rollup_collection, username, granularity, request.args.get("subject"), start, end, limit)
+        return jsonify({"username": username, "granularity": granularity, "trends": result}), 200
+    except Exception as e:
+        logger.error(f"Error reading trends for {username}: {str(e)}")
+        return jsonify({"error": "Failed to read trends"}), 500
+
+# Backfill rollups from performance_data: {"username": ..., "granularities": ["week"]}, both optional
+@app.route('/rebuild-rollups', methods=['POST'])
+def rebuild_rollups():
+    data = request.get_json(silent=True) or {}
+    granularities = data.get("granularities")
+    if granularities is not None and (not isinstance(granularities, list) or not set(granularities) <= set(GRANULARITIES)):
+        return jsonify({"error": f"granularities must be a list of {', '.join(GRANULARITIES)}"}), 400
+    try:
+        task = rebuild_rollups_task.apply_async(kwargs={
+            "username": data.get("username"),
+            "granularities": granularities,
+            "enqueued_at": time.time()
+        })
+        return jsonify({"task_id": task.id, "status": "Processing"}), 202
+    except Exception as e:
+        logger.error(f"Error submitting rollup rebuild: {str(e)}")
+        return jsonify({"error": "Failed to submit task"}), 500
+
+# Export new performance_data / quiz_results rows to columnar files: {"collections": [...]}, optional
+@app.route('/export', methods=['POST'])
+def export():
+    collections = (request.get_json(silent=True) or {}).get("collections")
+    if collections is not None and (not isinstance(collections, list) or not set(collections) <= set(EXPORTS)):
+        return jsonify({"error": f"collections must be a list of {', '.join(EXPORTS)}"}), 400
+    try:
+        task = export_collections_task.apply_async(kwargs={"collections": collections, "enqueued_at": time.time()})
+        return jsonify({"task_id": task.id, "status": "Processing"}), 202
+    except Exception as e:
+        logger.error(f"Error submitting export: {str(e)}")
+        return jsonify({"error": "Failed to submit task"}), 500
+
+# Approximate distinct students and score / time_taken quantiles from the daily sketches.
+# dimension is subject, quiz or all; ?from=&to= are dates (default today, UTC) and
+# ?q=0.5,0.9 the quantiles wanted.
+@app.route('/sketches/all', defaults={'dimension': 'all', 'value': 'all'}, methods=['GET'])
+@app.route('/sketches/<dimension>/<value>', methods=['GET'])
+def sketches(dimension, value):
+    if dimension not in SKETCH_DIMENSIONS:
+        return jsonify({"error": f"dimension must be one of {', '.join(SKETCH_DIMENSIONS)}"}), 400
+    try:
+        today = datetime.datetime.utcnow().date()
+        start = datetime.date.fromisoformat(request.args["from"]) if request.args.get("from") else today
+        end = datetime.date.fromisoformat(request.args["to"]) if request.args.get("to") else max(start, today)
+        quantiles = [float(q) for q in request.args.get("q", "0.5,0.9").split(",")]
+    except ValueError:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD) and q a list of numbers"}), 400
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        return jsonify({"error": f"Date range must be between 1 and {MAX_RANGE_DAYS} days"}), 400
+    if not all(0 <= q <= 1 for q in quantiles):
+        return jsonify({"error": "Quantiles must be between 0 and 1"}), 400
+
+    try:
+        return jsonify(sketch_summary(cache_redis, dimension, value, start, end, quantiles)), 200
+    except Exception as e:
+        logger.error(f"Error reading sketches for {dimension} {value}: {str(e)}")
+        return jsonify({"error": "Failed to read sketches"}), 500
+
+# Create a cohort: {"name": "Class 7B", "members": ["alice123", ...]}
+@app.route('/cohorts', methods=['POST'])
+def create_cohort():
+    data = request.get_json(silent=True) or {}
+    members = data.get("members")
+    if not data.get("name") or not isinstance(members, list) or not all(isinstance(m, str) for m in members):
+        return jsonify({"error": "name and a list of member usernames are required"}), 400
+
+    try:
+        cohort = {
+            "name": data["name"],
+            "members": list(dict.fromkeys(members)),
+            "createdBy": data.get("createdBy"),
+            "createdAt": datetime.datetime.utcnow()
+        }
+        result = cohort_collection.insert_one(cohort)
+        return jsonify({"cohortId": str(result.inserted_id), "name": cohort["name"], "members": len(cohort["members"])}), 201
+    except Exception as e:
+        logger.error(f"Error creating cohort: {str(e)}")
+        return jsonify({"error": "Failed to create cohort"}), 500
+
+# Replace a cohort's name and/or members
+@app.route('/cohorts/<cohort_id>', methods=['PUT'])
+def update_cohort(cohort_id):
+    data = request.get_json(silent=True) or {}
+    update = {}
+    if "name" in data:
+        update["name"] = data["name"]
+    if "members" in data:
+        if not isinstance(data["members"], list) or not all(isinstance(m, str) for m in data["members"]):
+            return jsonify({"error": "members must be a list of usernames"}), 400
+        update["members"] = list(dict.fromkeys(data["members"]))
+    if not update:
+        return jsonify({"error": "Nothing to update"}), 400
+
+    try:
+        result = cohort_collection.update_one({"_id": ObjectId(cohort_id)}, {"$set": update})
+        if result.matched_count == 0:
+            return jsonify({"error": "Cohort not found"}), 404
+        cache_redis.delete(cohort_cache_key(cohort_id))
+        return jsonify({"message": "Cohort updated"}), 200
+    except Exception as e:
+        logger.error(f"Error updating cohort {cohort_id}: {str(e)}")
+        return jsonify({"error": "Failed to update cohort"}), 500
+
+# Class-wide analytics: score distributions per subject, student average percentiles,
+# at-risk students (?threshold=, default 50) and the weekly trend
+@app.route('/cohort-analytics/<cohort_id>', methods=['GET'])
+def cohort_analytics(cohort_id):
+    threshold = request.args.get("threshold", DEFAULT_AT_RISK_THRESHOLD, type=float)
+    try:
+        cohort = cohort_collection.find_one({"_id": ObjectId(cohort_id)})
+        if not cohort:
+            return jsonify({"error": "Cohort not found"}), 404
+        return jsonify(get_cohort_analytics(db, cache_redis, cohort, threshold)), 200
+    except Exception as e:
+        logger.error(f"Error computing analytics for cohort {cohort_id}: {str(e)}")
+        return jsonify({"error": "Failed to compute cohort analytics"}), 500
+
 @app.route('/task-status/<task_id>', methods=['GET'])
 def task_status(task_id):
     try:
         # Check the status of the Celery task
-        task = generate_insights.AsyncResult(task_id)
+        task = celery.AsyncResult(task_id)
         if task.state == "PENDING":
             return jsonify({"status": "Pending"})
         elif task.state == "SUCCESS":
@@ -61,5 +346,13 @@ def task_status(task_id):
         logger.error(f"Error checking task status {task_id}: {str(e)}")
         return jsonify({"error": "Failed to check task status"}), 500
 
+@app.route('/queue-metrics', methods=['GET'])
+def get_queue_metrics():
+    try:
+        return jsonify(queue_metrics(broker_redis, ANALYTICS_QUEUE)), 200
+    except Exception as e:
+        logger.error(f"Error reading queue metrics: {str(e)}")
+        return jsonify({"error": "Failed to read queue metrics"}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5003, debug=True)
@@ -1,9 +1,25 @@
+import os
+import sys
 from celery import Celery
+from kombu import Queue
+
+try:
+    from common.queue_metrics import queue_metrics, record_queue_wait
+except ImportError:
+    # Running from the source tree: common/ sits next to the service directory
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from common.queue_metrics import queue_metrics, record_queue_wait
+
+# Analytics uses its own Redis database so its queue never mixes with quiz feedback
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/1")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/1")
+
+ANALYTICS_QUEUE = "analytics"
 
 celery = Celery(
     'analytics_tasks',
-    broker='redis://localhost:6379/0',
-    backend='redis://localhost:6379/0'
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
 )
 
 celery.conf.update(
@@ -14,7 +30,20 @@ celery.conf.update(
     task_ignore_result=False,  # Ensure results are stored
     task_acks_late=False,     # Acknowledge tasks early
     worker_prefetch_multiplier=1,  # Reduce prefetching to avoid overloading
-    task_default_queue='celery',   # Explicitly set default queue
+    task_queues=(Queue(ANALYTICS_QUEUE),),
+    task_default_queue=ANALYTICS_QUEUE,
+    task_routes={
+        'tasks.rebuild_summaries': {'queue': ANALYTICS_QUEUE},
+        'tasks.rebuild_rollups': {'queue': ANALYTICS_QUEUE},
+        'tasks.export_collections': {'queue': ANALYTICS_QUEUE},
+    },
+    # Redis emulates priorities with one list per level; 0 is served first
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+    task_default_priority=5,
 )
 
-import tasks
\ No newline at end of file
+import tasks
@@ -0,0 +1,164 @@
+"""
+Class-wide analytics for a cohort of students.
+
+A cohort is a named list of usernames in the cohorts collection. Its analytics
+are computed from performance_data and quiz_results: each is read with one
+projected query, turned into NumPy arrays (student and subject as integer
+codes, score, day) and summarized without per-student Python loops.
+
+Results are cached as JSON in the Redis hash cohort_analytics:<cohort id>, one
+field per at-risk threshold. Submissions from a member delete the hash (see
+invalidate_cohort_analytics), so a cached answer is never older than the data.
+"""
+import datetime
+import json
+
+import numpy as np
+
+COHORT_CACHE_PREFIX = "cohort_analytics:"
+COHORT_CACHE_TTL = 3600  # safety net, submissions invalidate explicitly
+DEFAULT_AT_RISK_THRESHOLD = 50
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = np.arange(0, 101, 10)
+TREND_WEEKS = 12
+AT_RISK_LIMIT = 100  # at-risk students listed, lowest averages first
+
+# (collection, timestamp field, filter) for each source of a cohort's scores. Quiz
+# results also reach performance_data through the event stream; they are read from
+# quiz_results only, so they are not counted twice.
+SOURCES = (
+    ("performance_data", "timestamp", {"source": {"$ne": "quiz"}}),
+    ("quiz_results", "completedAt", {}),
+)
+
+def cohort_cache_key(cohort_id):
+    return f"{COHORT_CACHE_PREFIX}{cohort_id}"
+
+def invalidate_cohort_analytics(db, redis_conn, usernames):
+    """Drop cached analytics of every cohort containing any of the users"""
+    cohorts = db["cohorts"].find({"members": {"$in": list(usernames)}}, {"_id": 1})
+    keys = [cohort_cache_key(cohort["_id"]) for cohort in cohorts]
+    if keys:
+        redis_conn.delete(*keys)
+
+def load_cohort_arrays(db, members):
+    """
+    Scores of the cohort's members from every source as parallel arrays:
+    student index (into members), subject code, score and day since the epoch.
+    """
+    member_index = {username: i for i, username in enumerate(members)}
+    subjects = {}
+    students, subject_codes, scores, days = [], [], [], []
+    counts = {}
+
+    for collection, time_field, source_filter in SOURCES:
+        cursor = db[collection].find(
+            {"username": {"$in": members}, **source_filter},
+            {"_id": 0, "username": 1, "subject": 1, "score": 1, time_field: 1}
+        ).batch_size(10000)
+        rows = list(cursor)
+        counts[collection] = len(rows)
+
+        students.extend(member_index[row["username"]] for row in rows)
+        subject_codes.extend(subjects.setdefault(row.get("subject") or "Unknown", len(subjects)) for row in rows)
+        scores.extend(row.get("score") or 0 for row in rows)
+        # Missing dates become day 0 and are left out of the trend
+        days.extend(row.get(time_field) or datetime.datetime(1970, 1, 1) for row in rows)
+
+    arrays = {
+        "student": np.asarray(students, dtype=np.int64),
+        "subject": np.asarray(subject_codes, dtype=np.int64),
+        "score": np.asarray(scores, dtype=np.float64),
+        "day": np.asarray(days, dtype="datetime64[D]").astype(np.int64),
+    }
+    subject_names = [None] * len(subjects)
+    for name, code in subjects.items():
+        subject_names[code] = name
+    return arrays, subject_names, counts
+
+def describe(scores):
+    """Count, mean, percentiles and a 10-point histogram of a score array"""
+    histogram, _ = np.histogram(np.clip(scores, 0, 100), bins=HISTOGRAM_BINS)
+    return {
+        "count": int(scores.size),
+        "mean": round(float(scores.mean()), 2),
+        "percentiles": {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(scores, PERCENTILES))},
+        "histogram": {"bins": HISTOGRAM_BINS.tolist(), "counts": histogram.tolist()},
+    }
+
+def compute_cohort_analytics(members, arrays, subject_names, at_risk_threshold=DEFAULT_AT_RISK_THRESHOLD):
+    student, subject, score, day = arrays["student"], arrays["subject"], arrays["score"], arrays["day"]
+    result = {
+        "students": len(members),
+        "studentsWithData": 0,
+        "subjects": {},
+        "studentAverages": None,
+        "atRisk": {"threshold": at_risk_threshold, "count": 0, "students": []},
+        "trend": [],
+    }
+    if score.size == 0:
+        return result
+
+    # Score distribution per subject
+    order = np.argsort(subject, kind="stable")
+    boundaries = np.flatnonzero(np.diff(subject[order])) + 1
+    for group in np.split(order, boundaries):
+        result["subjects"][subject_names[subject[group[0]]]] = describe(score[group])
+
+    # Average per student, and the students below the at-risk threshold
+    attempts = np.bincount(student, minlength=len(members))
+    totals = np.bincount(student, weights=score, minlength=len(members))
+    active = np.flatnonzero(attempts)
+    averages = totals[active] / attempts[active]
+    result["studentsWithData"] = int(active.size)
+    result["studentAverages"] = describe(averages)
+
+    at_risk = np.flatnonzero(averages < at_risk_threshold)
+    at_risk = at_risk[np.argsort(averages[at_risk], kind="stable")]
+    result["atRisk"]["count"] = int(at_risk.size)
+    result["atRisk"]["students"] = [
+        {"username": members[active[i]], "averageScore": round(float(averages[i]), 2), "attempts": int(attempts[active[i]])}
+        for i in at_risk[:AT_RISK_LIMIT]
+    ]
+
+    # Weekly average over the most recent weeks, skipping records without a date.
+    # Day 0 (1970-01-01) was a Thursday, so (day + 3) % 7 is the weekday with Monday as 0.
+    dated = day > 0
+    week = day[dated] - (day[dated] + 3) % 7
+    weeks, week_index = np.unique(week, return_inverse=True)
+    week_attempts = np.bincount(week_index, minlength=weeks.size)
+    week_averages = np.bincount(week_index, weights=score[dated], minlength=weeks.size) / np.maximum(week_attempts, 1)
+    recent = slice(max(0, weeks.size - TREND_WEEKS), weeks.size)
+    result["trend"] = [
+        {
+            "weekStart": str(np.datetime64(int(start), "D")),
+            "averageScore": round(float(average), 2),
+            "attempts": int(count),
+        }
+        for start, average, count in zip(weeks[recent], week_averages[recent], week_attempts[recent])
+    ]
+    return result
+
+def get_cohort_analytics(db, redis_conn, cohort, at_risk_threshold=DEFAULT_AT_RISK_THRESHOLD):
+    """Cached analytics for a cohort document"""
+    cache_key = cohort_cache_key(cohort["_id"])
+    field = f"threshold:{at_risk_threshold:g}"
+    cached = redis_conn.hget(cache_key, field)
+    if cached:
+        return json.loads(cached)
+
+    members = list(dict.fromkeys(cohort.get("members", [])))
+    arrays, subject_names, counts = load_cohort_arrays(db, members)
+    result = compute_cohort_analytics(members, arrays, subject_names, at_risk_threshold)
+    result.update({
+        "cohortId": str(cohort["_id"]),
+        "name": cohort.get("name"),
+        "records": counts,
+        "generatedAt": datetime.datetime.utcnow().isoformat(),
+    })
+
+    pipe = redis_conn.pipeline()
+    pipe.hset(cache_key, field, json.dumps(result))
+    pipe.expire(cache_key, COHORT_CACHE_TTL)
+    pipe.execute()
+    return result
@@ -0,0 +1,193 @@
+"""
+Columnar export of performance_data and quiz_results for offline analysis.
+
+Each collection is streamed by cursor in chunks of EXPORT_CHUNK_ROWS documents,
+so memory stays bounded however large it is, and written under EXPORT_DIR:
+
+    <EXPORT_DIR>/<collection>/manifest.json
+    <EXPORT_DIR>/<collection>/part-<run>.parquet        with pyarrow installed
+    <EXPORT_DIR>/<collection>/part-<run>-<chunk>/*.npy  otherwise, one file per column
+
+Exports are incremental: the manifest keeps a watermark (the newest ingestedAt /
+completedAt exported) and each run only reads documents after it. Both are set
+by the server when the document is written, so events backfilled with an old
+timestamp are still exported; performance_data written before ingestedAt was
+stamped falls back to its timestamp. Documents are exported up to a few seconds
+before the run started, so writes still in flight are not skipped.
+
+Only parts listed in the manifest are complete; files left by a crashed run are
+not, and their rows are exported again by the next run.
+
+Parquet parts can be read with pyarrow.parquet.read_table(path, memory_map=True)
+and column files with numpy.load(path, mmap_mode="r").
+
+    python export.py [performance_data] [quiz_results]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 50000))
+EXPORT_LAG = datetime.timedelta(seconds=5)
+
+# Exported columns and their types: "str", "float" or "datetime"
+EXPORTS = {
+    "performance_data": {
+        "time_field": "ingestedAt",
+        "legacy_time_field": "timestamp",
+        "columns": {"username": "str", "subject": "str", "score": "float", "time_taken": "float", "timestamp": "datetime",
+                    "source": "str"},
+    },
+    "quiz_results": {
+        "time_field": "completedAt",
+        "columns": {"quizId": "str", "quizVersion": "str", "username": "str", "subject": "str", "score": "float",
+                    "correctCount": "float", "totalQuestions": "float", "completedAt": "datetime"},
+    },
+}
+
+def load_manifest(directory):
+    path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(path):
+        return {"watermark": None, "parts": []}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(directory, manifest):
+    # Written to a temporary file first so a crash never leaves a half-written manifest
+    path = os.path.join(directory, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def to_numpy(values, kind):
+    if kind == "float":
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if kind == "datetime":
+        return np.array([np.datetime64("NaT") if v is None else v for v in values], dtype="datetime64[ms]")
+    return np.array(["" if v is None else str(v) for v in values], dtype=np.str_)
+
+def to_arrow(values, kind):
+    if kind == "float":
+        return pa.array([None if v is None else float(v) for v in values], type=pa.float64())
+    if kind == "datetime":
+        return pa.array(values, type=pa.timestamp("ms"))
+    return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+class PartWriter:
+    """Writes the chunks of one export run as a Parquet file, or as .npy column directories"""
+
+    def __init__(self, directory, run_id, columns):
+        self.directory = directory
+        self.run_id = run_id
+        self.columns = columns
+        self.parts = []
+        self.chunks = 0
+        self._parquet = None
+        if pa is not None:
+            self.schema = pa.schema([(name, to_arrow([], kind).type) for name, kind in columns.items()])
+
+    def write(self, chunk):
+        if pa is not None:
+            if self._parquet is None:
+                name = f"part-{self.run_id}.parquet"
+                self._parquet = pq.ParquetWriter(os.path.join(self.directory, name), self.schema)
+                self.parts.append(name)
+            table = pa.Table.from_arrays([to_arrow(chunk[name], kind) for name, kind in self.columns.items()], schema=self.schema)
+            self._parquet.write_table(table)
+        else:
+            name = f"part-{self.run_id}-{self.chunks:05d}"
+            os.makedirs(os.path.join(self.directory, name))
+            for column, kind in self.columns.items():
+                np.save(os.path.join(self.directory, name, f"{column}.npy"), to_numpy(chunk[column], kind))
+            self.parts.append(name)
+        self.chunks += 1
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+def export_collection(db, collection, export_dir=EXPORT_DIR):
+    """Export documents newer than the collection's watermark; returns the number of rows written"""
+    spec = EXPORTS[collection]
+    time_field, columns = spec["time_field"], spec["columns"]
+    legacy_field = spec.get("legacy_time_field")
+    directory = os.path.join(export_dir, collection)
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    db[collection].create_index(time_field)
+    if legacy_field:
+        db[collection].create_index(legacy_field)
+
+    cutoff = datetime.datetime.utcnow() - EXPORT_LAG
+    time_range = {"$lte": cutoff}
+    if manifest["watermark"]:
+        time_range["$gt"] = datetime.datetime.fromisoformat(manifest["watermark"])
+
+    query = {time_field: time_range}
+    sort = [(time_field, 1)]
+    if legacy_field:
+        query = {"$or": [query, {time_field: {"$exists": False}, legacy_field: time_range}]}
+        sort.append((legacy_field, 1))
+    cursor = db[collection].find(
+        query,
+        {"_id": 0, time_field: 1, **({legacy_field: 1} if legacy_field else {}), **{name: 1 for name in columns}}
+    ).sort(sort).batch_size(min(EXPORT_CHUNK_ROWS, 10000))
+
+    run_id = cutoff.strftime("%Y%m%dT%H%M%S")
+    writer = PartWriter(directory, run_id, columns)
+    chunk = {name: [] for name in columns}
+    rows = 0
+    watermark = None
+    try:
+        for document in cursor:
+            for name in columns:
+                chunk[name].append(document.get(name))
+            exported_at = document.get(time_field) or document[legacy_field]
+            watermark = exported_at if watermark is None else max(watermark, exported_at)
+            rows += 1
+            if rows % EXPORT_CHUNK_ROWS == 0:
+                writer.write(chunk)
+                chunk = {name: [] for name in columns}
+        if rows % EXPORT_CHUNK_ROWS:
+            writer.write(chunk)
+    finally:
+        writer.close()
+
+    if rows:
+        manifest["watermark"] = watermark.isoformat()
+        manifest["parts"].append({
+            "run": run_id,
+            "format": "parquet" if pa is not None else "npy",
+            "files": writer.parts,
+            "rows": rows,
+            "exportedAt": datetime.datetime.utcnow().isoformat(),
+        })
+        save_manifest(directory, manifest)
+    logger.info(f"Exported {rows} {collection} rows")
+    return rows
+
+if __name__ == '__main__':
+    from tasks import get_db
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export analytics collections to columnar files")
+    parser.add_argument("collections", nargs="*", help=f"collections to export: {', '.join(EXPORTS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.collections) - set(EXPORTS)
+    if unknown:
+        parser.error(f"unknown collections: {', '.join(sorted(unknown))}")
+    for name in args.collections or list(EXPORTS):
+        export_collection(get_db(), name)
@@ -0,0 +1,219 @@
+"""
+Performance event ingestion.
+
+Events are validated once, written with a single unordered insert_many and then
+folded into the per-user summaries and the time-bucketed rollups with one bulk
+write each and into the daily sketches with one Redis pipeline, so the cost of a batch grows with the number of users and buckets
+in it rather than the number of events.
+
+Each document is inserted with the derived updates it still needs listed in
+"pending", and each update is struck off once it is applied. A replayed event
+that hits a duplicate key gets whatever its stored copy still has pending, so
+an insert whose derived updates failed half way is completed by the replay
+instead of being skipped.
+
+BufferedWriter coalesces events posted one at a time into the same bulk path:
+requests only validate and enqueue, and a background thread flushes the buffer
+every INGEST_FLUSH_INTERVAL seconds or as soon as INGEST_BATCH_SIZE events are
+waiting.
+"""
+import atexit
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from pymongo.errors import BulkWriteError
+
+from summaries import SUMMARY_COLLECTION, apply_many_to_summaries
+from rollups import ROLLUP_COLLECTION, apply_many_to_rollups
+from cohorts import invalidate_cohort_analytics
+from sketches import update_sketches
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = ("score", "time_taken")
+DERIVED_STEPS = ("summaries", "rollups", "sketches")
+DUPLICATE_KEY_CODE = 11000
+ID_FIELDS = ("eventId", "resultId")
+
+def validate_event(event):
+    """Return (document, None) for a valid event or (None, error message)"""
+    if not isinstance(event, dict):
+        return None, "event must be a JSON object"
+    if not isinstance(event.get("username"), str) or not event["username"]:
+        return None, "username is required"
+    if event.get("subject") is not None and not isinstance(event["subject"], str):
+        return None, "subject must be a string"
+    for field in NUMERIC_FIELDS:
+        value = event.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return None, f"{field} must be a number"
+    for field in ID_FIELDS:
+        if event.get(field) is not None and (not isinstance(event[field], str) or not event[field]):
+            return None, f"{field} must be a non-empty string"
+
+    document = dict(event)
+    document.pop("_id", None)
+    if document.get("subject") == "":
+        # Stored like a missing subject, which every summary counts as "Unknown"
+        document.pop("subject")
+    # Events that carry an ID are stored under it, so a client retrying a request
+    # that failed after the insert gets duplicates instead of double counting
+    if event.get("eventId"):
+        document["_id"] = f"event:{event['eventId']}"
+    elif event.get("resultId"):
+        document["_id"] = f"quiz_result:{event['resultId']}"
+    timestamp = event.get("timestamp")
+    if timestamp is None:
+        document["timestamp"] = datetime.datetime.utcnow()
+    else:
+        # Backfilled events keep their own time, given as ISO 8601; times with an
+        # offset are converted to UTC, naive ones are taken as UTC already
+        try:
+            parsed = datetime.datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            return None, "timestamp must be an ISO 8601 date"
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        document["timestamp"] = parsed
+    return document, None
+
+def validate_events(events):
+    """Validate a batch in one pass; returns the documents and [{"index", "error"}] for the rest"""
+    documents, indexes, errors = [], [], []
+    for i, event in enumerate(events):
+        document, error = validate_event(event)
+        if error:
+            errors.append({"index": i, "error": error})
+        else:
+            documents.append(document)
+            indexes.append(i)
+    return documents, indexes, errors
+
+def ingest_records(db, cache_redis, documents):
+    """
+    Insert validated documents and update everything derived from them. Returns
+    the positions (within documents) that could not be inserted, with the reason
+    and whether the event had already been stored.
+    """
+    if not documents:
+        return []
+
+    # Stamped here rather than taken from the event, so exports can watermark on it
+    ingested_at = datetime.datetime.utcnow()
+    for document in documents:
+        document["ingestedAt"] = ingested_at
+        document["pending"] = list(DERIVED_STEPS)
+
+    failed, duplicates = {}, []
+    try:
+        db["performance_data"].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            if write_error.get("code") == DUPLICATE_KEY_CODE:
+                duplicates.append(documents[write_error["index"]]["_id"])
+                failed[write_error["index"]] = (write_error.get("errmsg", "duplicate event"), True)
+            else:
+                failed[write_error["index"]] = (write_error.get("errmsg", "write failed"), False)
+
+    records = [document for i, document in enumerate(documents) if i not in failed]
+    if duplicates:
+        # Copies stored by an earlier attempt that failed before finishing its derived updates
+        inserted_ids = {document["_id"] for document in records}
+        records += db["performance_data"].find({
+            "_id": {"$in": [_id for _id in duplicates if _id not in inserted_ids]},
+            "pending.0": {"$exists": True},
+        })
+    if records:
+        apply_derived(db, cache_redis, records)
+    return [{"position": i, "error": error, "duplicate": duplicate} for i, (error, duplicate) in sorted(failed.items())]
+
+def apply_derived(db, cache_redis, records):
+    """Apply the derived updates each record still has pending, striking each off once it is done"""
+    for step in DERIVED_STEPS:
+        todo = [record for record in records if step in record["pending"]]
+        if not todo:
+            continue
+        if step == "summaries":
+            apply_many_to_summaries(db[SUMMARY_COLLECTION], todo)
+        elif step == "rollups":
+            apply_many_to_rollups(db[ROLLUP_COLLECTION], todo)
+        else:
+            update_sketches(cache_redis, todo)
+        # The last step is struck off together with the rest below
+        if step != DERIVED_STEPS[-1]:
+            db["performance_data"].update_many({"_id": {"$in": [record["_id"] for record in todo]}},
+                                               {"$pull": {"pending": step}})
+
+    db["performance_data"].update_many({"_id": {"$in": [record["_id"] for record in records]}},
+                                       {"$unset": {"pending": ""}})
+    invalidate_cohort_analytics(db, cache_redis, {record["username"] for record in records})
+
+class BufferedWriter:
+    """Collects single events and writes them in batches from a background thread"""
+
+    def __init__(self, db, cache_redis, batch_size=500, flush_interval=0.25, max_buffered=10000):
+        self.db = db
+        self.cache_redis = cache_redis
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_buffered)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, document):
+        """Buffer a validated document; writes it straight away if the buffer is full"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(document)
+        except queue.Full:
+            ingest_records(self.db, self.cache_redis, [document])
+
+    def _ensure_started(self):
+        # Started on first use so only the process that serves requests runs it
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="performance-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _take_batch(self, linger):
+        """Wait for an event, then keep collecting for up to flush_interval or until the batch is full"""
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=1.0) if linger else self.queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + (self.flush_interval if linger else 0)
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            for failure in ingest_records(self.db, self.cache_redis, batch):
+                if not failure["duplicate"]:
+                    logger.error(f"Dropped buffered performance event: {failure['error']}")
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} buffered performance events: {str(e)}")
+
+    def _run(self):
+        while True:
+            batch = self._take_batch(linger=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything still buffered, used at shutdown"""
+        while True:
+            batch = self._take_batch(linger=False)
+            if not batch:
+                return
+            self._write(batch)
@@ -0,0 +1,150 @@
+"""
+Time-bucketed performance rollups.
+
+Alongside the raw events, performance_rollups keeps one document per user,
+subject, granularity (hour, day or week) and bucket start:
+
+    {
+        "_id": "alice123|Mathematics|week|2025-04-07T00:00:00",
+        "username": "alice123", "subject": "Mathematics",
+        "granularity": "week", "bucket": ISODate("2025-04-07"),
+        "count": 5, "total_score": 372, "total_time": 140,
+        "min_score": 48, "max_score": 91
+    }
+
+Ingest updates them incrementally; rebuild_rollups recomputes them from
+performance_data. Weeks start on Monday and all buckets are in UTC.
+"""
+import datetime
+
+from pymongo import UpdateOne
+
+from summaries import SUBJECT_EXPRESSION, record_values
+
+ROLLUP_COLLECTION = "performance_rollups"
+GRANULARITIES = ("hour", "day", "week")
+
+def bucket_start(timestamp, granularity):
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    return day - datetime.timedelta(days=day.weekday())
+
+def rollup_id(username, subject, granularity, bucket):
+    return f"{username}|{subject}|{granularity}|{bucket.isoformat()}"
+
+def ensure_rollup_indexes(collection):
+    collection.create_index([("username", 1), ("granularity", 1), ("bucket", 1)])
+
+def apply_many_to_rollups(collection, records):
+    """Fold a batch of records into every granularity, one update per touched bucket"""
+    buckets = {}
+    for record in records:
+        subject, score, time_taken = record_values(record)
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(record["timestamp"], granularity)
+            key = rollup_id(record["username"], subject, granularity, bucket)
+            entry = buckets.get(key)
+            if entry is None:
+                entry = buckets[key] = {
+                    "fields": {"username": record["username"], "subject": subject,
+                               "granularity": granularity, "bucket": bucket},
+                    "count": 0, "total_score": 0, "total_time": 0,
+                    "min_score": score, "max_score": score,
+                }
+            entry["count"] += 1
+            entry["total_score"] += score
+            entry["total_time"] += time_taken
+            entry["min_score"] = min(entry["min_score"], score)
+            entry["max_score"] = max(entry["max_score"], score)
+
+    if not buckets:
+        return
+    collection.bulk_write([
+        UpdateOne(
+            {"_id": key},
+            {
+                "$setOnInsert": entry["fields"],
+                "$inc": {"count": entry["count"], "total_score": entry["total_score"], "total_time": entry["total_time"]},
+                "$min": {"min_score": entry["min_score"]},
+                "$max": {"max_score": entry["max_score"]},
+            },
+            upsert=True
+        )
+        for key, entry in buckets.items()
+    ], ordered=False)
+
+def rebuild_rollups(db, username=None, granularities=GRANULARITIES):
+    """
+    Recompute rollups from performance_data inside MongoDB with $dateTrunc and
+    $merge (MongoDB 5.0+). Like the summary rebuild, it can overwrite increments
+    made while it runs, so use it to backfill or repair.
+    """
+    match = {"username": username} if username else {"username": {"$exists": True}}
+    match["timestamp"] = {"$type": "date"}
+    for granularity in granularities:
+        db["performance_data"].aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "username": "$username",
+                    "subject": SUBJECT_EXPRESSION,
+                    "bucket": {"$dateTrunc": {"date": "$timestamp", "unit": granularity, "startOfWeek": "monday"}},
+                },
+                "count": {"$sum": 1},
+                "total_score": {"$sum": {"$ifNull": ["$score", 0]}},
+                "total_time": {"$sum": {"$ifNull": ["$time_taken", 0]}},
+                "min_score": {"$min": {"$ifNull": ["$score", 0]}},
+                "max_score": {"$max": {"$ifNull": ["$score", 0]}},
+            }},
+            {"$project": {
+                "_id": {"$concat": [
+                    "$_id.username", "|", "$_id.subject", "|", granularity, "|",
+                    {"$dateToString": {"date": "$_id.bucket", "format": "%Y-%m-%dT%H:%M:%S"}},
+                ]},
+                "username": "$_id.username",
+                "subject": "$_id.subject",
+                "granularity": granularity,
+                "bucket": "$_id.bucket",
+                "count": 1, "total_score": 1, "total_time": 1, "min_score": 1, "max_score": 1,
+            }},
+            {"$merge": {"into": ROLLUP_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ], allowDiskUse=True)
+
+def get_trends(collection, username, granularity, subject=None, start=None, end=None, limit=12):
+    """Average score and time per bucket, oldest first, read from the rollups"""
+    query = {"username": username, "granularity": granularity}
+    if subject:
+        query["subject"] = subject
+    if start or end:
+        query["bucket"] = {}
+        if start:
+            query["bucket"]["$gte"] = bucket_start(start, granularity)
+        if end:
+            query["bucket"]["$lte"] = end
+
+    # The most recent `limit` buckets, across all matching subjects
+    latest = collection.find(query, {"bucket": 1}).sort("bucket", -1).limit(1)
+    recent = next(iter(latest), None)
+    if not recent:
+        return []
+    if not start:
+        first_bucket = recent["bucket"]
+        for _ in range(limit - 1):
+            first_bucket = bucket_start(first_bucket - datetime.timedelta(microseconds=1), granularity)
+        query.setdefault("bucket", {})["$gte"] = first_bucket
+
+    trends = []
+    for rollup in collection.find(query).sort([("bucket", 1), ("subject", 1)]):
+        trends.append({
+            "bucket": rollup["bucket"].isoformat(),
+            "subject": rollup["subject"],
+            "attempts": rollup["count"],
+            "average_score": round(rollup["total_score"] / rollup["count"], 2),
+            "average_time": round(rollup["total_time"] / rollup["count"], 2),
+            "min_score": rollup["min_score"],
+            "max_score": rollup["max_score"],
+        })
+    return trends
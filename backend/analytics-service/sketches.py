@@ -0,0 +1,126 @@
+"""
+Streaming sketches over ingested performance events, kept in Redis per day for
+every subject, every quiz and overall ("all"):
+
+  sketch:users:<dimension>:<value>:<day>   HyperLogLog of usernames, standard error 0.81%
+  sketch:score:<dimension>:<value>:<day>   hash of score -> count over the 101 integer
+                                           scores 0-100, quantile error at most 0.5 points
+  sketch:time:<dimension>:<value>:<day>    hash of log bucket -> count for time_taken
+                                           (DDSketch buckets), relative error at most 1%
+
+Every sketch merges by union or by adding counts, so a date range is answered from
+one key per day, in memory bounded by the number of buckets and independent of how
+many events were ingested. A full t-digest would need the RedisBloom module, so the
+quantile sketches are plain hashes any Redis can keep.
+"""
+import datetime
+import math
+
+SKETCH_DIMENSIONS = ("subject", "quiz", "all")
+SKETCH_TTL = 400 * 86400  # a little over a year of daily sketches
+HLL_STANDARD_ERROR = 0.0081
+SCORE_MAX_ERROR = 0.5
+TIME_RELATIVE_ACCURACY = 0.01
+TIME_GAMMA = (1 + TIME_RELATIVE_ACCURACY) / (1 - TIME_RELATIVE_ACCURACY)
+TIME_ZERO_BUCKET = "z"
+MAX_RANGE_DAYS = 366
+
+def sketch_key(kind, dimension, value, day):
+    return f"sketch:{kind}:{dimension}:{value}:{day}"
+
+def time_bucket(time_taken):
+    if time_taken <= 0:
+        return TIME_ZERO_BUCKET
+    return str(math.ceil(math.log(time_taken, TIME_GAMMA)))
+
+def time_bucket_value(bucket):
+    if bucket == TIME_ZERO_BUCKET:
+        return 0.0
+    # Midpoint of the bucket in relative terms, within TIME_RELATIVE_ACCURACY of every value in it
+    return 2 * TIME_GAMMA ** int(bucket) / (TIME_GAMMA + 1)
+
+def event_dimensions(record):
+    dimensions = [("all", "all"), ("subject", record.get("subject") or "Unknown")]
+    if record.get("quizId"):
+        dimensions.append(("quiz", record["quizId"]))
+    return dimensions
+
+def update_sketches(redis_conn, records):
+    """Fold a batch of inserted records into the daily sketches with one pipeline"""
+    users, scores, times = {}, {}, {}
+    for record in records:
+        day = record["timestamp"].strftime("%Y-%m-%d")
+        for dimension, value in event_dimensions(record):
+            users.setdefault(sketch_key("users", dimension, value, day), set()).add(record["username"])
+            if record.get("score") is not None:
+                score = str(min(100, max(0, round(record["score"]))))
+                counts = scores.setdefault(sketch_key("score", dimension, value, day), {})
+                counts[score] = counts.get(score, 0) + 1
+            if record.get("time_taken") is not None:
+                bucket = time_bucket(record["time_taken"])
+                counts = times.setdefault(sketch_key("time", dimension, value, day), {})
+                counts[bucket] = counts.get(bucket, 0) + 1
+
+    if not users:
+        return
+    pipe = redis_conn.pipeline(transaction=False)
+    for key, usernames in users.items():
+        pipe.pfadd(key, *usernames)
+        pipe.expire(key, SKETCH_TTL)
+    for key, counts in list(scores.items()) + list(times.items()):
+        for field, count in counts.items():
+            pipe.hincrby(key, field, count)
+        pipe.expire(key, SKETCH_TTL)
+    pipe.execute()
+
+def days_between(start, end):
+    return [(start + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+def merge_counts(hashes):
+    merged = {}
+    for counts in hashes:
+        for field, count in counts.items():
+            field = field.decode()
+            merged[field] = merged.get(field, 0) + int(count)
+    return merged
+
+def quantiles_from_counts(counts, quantiles, value_of):
+    """Quantiles of a merged histogram, given how to turn a bucket into a value"""
+    buckets = sorted((value_of(field), count) for field, count in counts.items())
+    total = sum(count for _, count in buckets)
+    if not total:
+        return 0, {}
+    result = {}
+    for q in quantiles:
+        rank = q * (total - 1)
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen > rank:
+                result[f"p{round(q * 100, 2):g}"] = round(value, 2)
+                break
+    return total, result
+
+def sketch_summary(redis_conn, dimension, value, start, end, quantiles=(0.5, 0.9)):
+    """Distinct users and score / time_taken quantiles for a dimension value over a range of days"""
+    days = days_between(start, end)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.pfcount(*[sketch_key("users", dimension, value, day) for day in days])
+    for day in days:
+        pipe.hgetall(sketch_key("score", dimension, value, day))
+    for day in days:
+        pipe.hgetall(sketch_key("time", dimension, value, day))
+    results = pipe.execute()
+
+    distinct_users = results[0]
+    score_count, score_quantiles = quantiles_from_counts(merge_counts(results[1:1 + len(days)]), quantiles, int)
+    time_count, time_quantiles = quantiles_from_counts(merge_counts(results[1 + len(days):]), quantiles, time_bucket_value)
+    return {
+        "dimension": dimension,
+        "value": value,
+        "from": days[0],
+        "to": days[-1],
+        "distinctUsers": {"estimate": distinct_users, "standardError": HLL_STANDARD_ERROR},
+        "score": {"count": score_count, "quantiles": score_quantiles, "maxError": SCORE_MAX_ERROR},
+        "time_taken": {"count": time_count, "quantiles": time_quantiles, "relativeError": TIME_RELATIVE_ACCURACY},
+    }
@@ -0,0 +1,173 @@
+"""
+Consumes quiz graded events published by the quiz service and ingests them as
+performance data, so quiz results reach analytics without an extra request from
+the frontend. Also reads the quiz_results_deleted stream the quiz purge writes
+to, and drops the cohort analytics built from the deleted results.
+
+    python stream_consumer.py
+
+Consumers share the "analytics" consumer group, so more processes can be started
+to scale out; each event goes to one of them. Events are ingested in batches and
+acknowledged with one XACK per batch after they are written. Anything read but
+not acknowledged stays pending: a restarted consumer replays its own pending
+events first, and events left pending by a consumer that died are claimed by the
+others after STREAM_CLAIM_IDLE_MS. Each event is stored under an _id derived from
+its result ID, so a replayed event is never counted twice, and a replay finishes
+any derived updates an earlier attempt left pending.
+"""
+import json
+import logging
+import os
+import socket
+import time
+
+import redis
+
+from cohorts import invalidate_cohort_analytics
+from ingest import ingest_records, validate_event
+from tasks import get_db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+QUIZ_GRADED_STREAM = "events:quiz_graded"
+QUIZ_RESULTS_DELETED_STREAM = "events:quiz_results_deleted"
+STREAMS = (QUIZ_GRADED_STREAM, QUIZ_RESULTS_DELETED_STREAM)
+CONSUMER_GROUP = "analytics"
+CONSUMER_NAME = os.getenv("STREAM_CONSUMER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+STREAM_BLOCK_MS = 5000
+STREAM_CLAIM_IDLE_MS = 60000
+STREAM_CLAIM_INTERVAL = 30  # seconds between checks for events stuck with dead consumers
+RETRY_DELAY = 5
+
+def event_to_document(fields):
+    """Turn a stream entry into a validated performance_data document, or (None, error)"""
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    event = {
+        "username": fields.get("username"),
+        "subject": fields.get("subject"),
+        "source": "quiz",
+        "quizId": fields.get("quizId"),
+        "quizVersion": fields.get("quizVersion"),
+        "resultId": fields.get("resultId"),
+        "timestamp": fields.get("completedAt"),
+    }
+    try:
+        event["score"] = float(fields["score"])
+        event["correctCount"] = int(fields["correctCount"])
+        event["totalQuestions"] = int(fields["totalQuestions"])
+        if "timeTaken" in fields:
+            event["time_taken"] = float(fields["timeTaken"])
+    except (KeyError, ValueError):
+        return None, "missing or non-numeric score fields"
+    if not event["resultId"]:
+        return None, "resultId is required"
+
+    # Stored under quiz_result:<resultId>, so a replayed event is a duplicate
+    return validate_event(event)
+
+class StreamConsumer:
+    def __init__(self, redis_conn, db):
+        self.redis = redis_conn
+        self.db = db
+        self.cache_redis = redis_conn
+
+    def ensure_group(self):
+        for stream in STREAMS:
+            try:
+                # Start from the beginning of the stream so events published before the first run are ingested
+                self.redis.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def process(self, stream, entries):
+        """Handle a batch of entries from a stream and acknowledge them; raises if they could not be applied"""
+        if not entries:
+            return
+        if stream == QUIZ_RESULTS_DELETED_STREAM:
+            self.process_deleted(entries)
+        else:
+            self.process_graded(entries)
+        self.redis.xack(stream, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+
+    def process_deleted(self, entries):
+        usernames = set()
+        for entry_id, fields in entries:
+            if fields:
+                usernames.update(json.loads(fields[b"usernames"]))
+        if usernames:
+            invalidate_cohort_analytics(self.db, self.cache_redis, usernames)
+        logger.info(f"Invalidated cohort analytics for {len(usernames)} users with deleted quiz results")
+
+    def process_graded(self, entries):
+        documents = []
+        for entry_id, fields in entries:
+            if not fields:
+                continue  # trimmed from the stream while pending
+            document, error = event_to_document(fields)
+            if error:
+                # A malformed event will never succeed, so it is acknowledged and dropped
+                logger.error(f"Dropping event {entry_id}: {error}")
+                continue
+            documents.append(document)
+
+        for failure in ingest_records(self.db, self.cache_redis, documents):
+            if not failure["duplicate"]:
+                logger.error(f"Could not ingest event: {failure['error']}")
+        logger.info(f"Ingested {len(documents)} quiz graded events")
+
+    def read(self, stream_id):
+        """[(stream, entries)] for every stream with entries"""
+        response = self.redis.xreadgroup(
+            CONSUMER_GROUP, CONSUMER_NAME, {stream: stream_id for stream in STREAMS},
+            count=STREAM_BATCH_SIZE, block=None if stream_id == "0" else STREAM_BLOCK_MS
+        )
+        return [(stream.decode() if isinstance(stream, bytes) else stream, entries)
+                for stream, entries in response or [] if entries]
+
+    def claim_abandoned(self):
+        """Take over events that another consumer read but never acknowledged"""
+        for stream in STREAMS:
+            start = "0-0"
+            while True:
+                result = self.redis.xautoclaim(
+                    stream, CONSUMER_GROUP, CONSUMER_NAME,
+                    min_idle_time=STREAM_CLAIM_IDLE_MS, start_id=start, count=STREAM_BATCH_SIZE
+                )
+                start, entries = result[0], result[1]
+                if entries:
+                    logger.info(f"Claimed {len(entries)} abandoned events from {stream}")
+                    self.process(stream, entries)
+                if start in (b"0-0", "0-0"):
+                    break
+
+    def run(self):
+        self.ensure_group()
+        replay_pending = True  # our own unacknowledged events come first
+        next_claim = 0
+        while True:
+            try:
+                if time.time() >= next_claim:
+                    self.claim_abandoned()
+                    next_claim = time.time() + STREAM_CLAIM_INTERVAL
+
+                batches = self.read("0" if replay_pending else ">")
+                if replay_pending and not batches:
+                    replay_pending = False
+                    continue
+                for stream, entries in batches:
+                    self.process(stream, entries)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                logger.error(f"Redis unavailable: {str(e)}")
+                time.sleep(RETRY_DELAY)
+            except Exception as e:
+                # Nothing was acknowledged, so the batch is replayed from the pending list
+                logger.error(f"Error processing quiz graded events: {str(e)}")
+                replay_pending = True
+                time.sleep(RETRY_DELAY)
+
+if __name__ == '__main__':
+    StreamConsumer(redis.Redis.from_url(REDIS_URL), get_db()).run()
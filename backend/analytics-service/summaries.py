@@ -0,0 +1,150 @@
+"""
+Per-user performance summaries.
+
+Every submitted performance record is folded into one performance_summaries
+document per user with an atomic $inc (one per user per ingested batch):
+
+    {
+        "_id": "<username>",
+        "count": 12, "total_score": 903, "total_time": 410,
+        "subjects": {"Mathematics": {"count": 7, "total_score": 560}, ...}
+    }
+
+so insights only have to look at one document with one entry per subject.
+Users whose data predates summaries get theirs backfilled from performance_data
+the first time a new record creates it.
+"""
+import datetime
+
+from pymongo import ReplaceOne, UpdateOne
+
+SUMMARY_COLLECTION = "performance_summaries"
+WEAK_SUBJECT_THRESHOLD = 50
+REBUILD_BATCH_SIZE = 500
+
+def subject_key(subject):
+    """Escape a subject name for use as a field name ('.' and '$' are not allowed)"""
+    return str(subject).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+def subject_name(key):
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+# The subject rebuilds group by, matching record_values: missing, null and "" are all "Unknown"
+SUBJECT_EXPRESSION = {"$cond": [{"$eq": [{"$ifNull": ["$subject", ""]}, ""]}, "Unknown", "$subject"]}
+
+def record_values(record):
+    """The (subject, score, time_taken) a record contributes, with the defaults insights always used"""
+    return (
+        record.get("subject") or "Unknown",
+        record.get("score") or 0,
+        record.get("time_taken") or 0,
+    )
+
+def summary_increment(record):
+    subject, score, time_taken = record_values(record)
+    key = subject_key(subject)
+    return {
+        "count": 1,
+        "total_score": score,
+        "total_time": time_taken,
+        f"subjects.{key}.count": 1,
+        f"subjects.{key}.total_score": score,
+    }
+
+def apply_many_to_summaries(collection, records):
+    """Fold a batch of records into the summaries with one update per user"""
+    increments = {}
+    for record in records:
+        totals = increments.setdefault(record["username"], {})
+        for field, value in summary_increment(record).items():
+            totals[field] = totals.get(field, 0) + value
+
+    now = datetime.datetime.utcnow()
+    usernames = list(increments)
+    result = collection.bulk_write([
+        UpdateOne({"_id": username}, {"$inc": increments[username], "$set": {"updatedAt": now}}, upsert=True)
+        for username in usernames
+    ], ordered=False)
+
+    # A summary created by this batch only holds the batch, so users with older
+    # records (already inserted along with the batch) are rebuilt from all of them
+    created = [usernames[i] for i in result.upserted_ids]
+    if created:
+        rebuild_summaries(collection.database, usernames=created)
+
+def insights_from_summary(summary):
+    """Insights in the same shape the analytics dashboard has always shown"""
+    subjects = {
+        subject_name(key): (values["count"], values["total_score"] / values["count"])
+        for key, values in summary.get("subjects", {}).items()
+        if values.get("count")
+    }
+    if not summary.get("count") or not subjects:
+        return None
+
+    # Ties on attempts go to the alphabetically first subject so the answer is stable
+    most_attempted_subject = min(subjects, key=lambda name: (-subjects[name][0], name))
+    return {
+        "average_score": round(summary["total_score"] / summary["count"], 2),
+        "total_time_spent": summary["total_time"],
+        "most_attempted_subject": most_attempted_subject,
+        "weak_subjects": [name for name, (_, average) in subjects.items() if average < WEAK_SUBJECT_THRESHOLD],
+    }
+
+def rebuild_summaries(db, username=None, usernames=None):
+    """
+    Recompute summaries from performance_data, for one user, a list of users or
+    for everyone.
+    Records submitted while a rebuild runs may be overwritten, so run it as a
+    backfill or repair, not alongside heavy ingest.
+    """
+    if username:
+        match = {"username": username}
+    elif usernames:
+        match = {"username": {"$in": list(usernames)}}
+    else:
+        match = {"username": {"$exists": True}}
+    groups = db["performance_data"].aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"username": "$username", "subject": SUBJECT_EXPRESSION},
+            "count": {"$sum": 1},
+            "total_score": {"$sum": {"$ifNull": ["$score", 0]}},
+            "total_time": {"$sum": {"$ifNull": ["$time_taken", 0]}},
+        }},
+        {"$sort": {"_id.username": 1}},
+    ], allowDiskUse=True)
+
+    summaries = db[SUMMARY_COLLECTION]
+    requests = []
+    rebuilt = 0
+    current = None
+
+    def flush(summary):
+        requests.append(ReplaceOne({"_id": summary["_id"]}, summary, upsert=True))
+        if len(requests) >= REBUILD_BATCH_SIZE:
+            summaries.bulk_write(requests, ordered=False)
+            requests.clear()
+
+    for group in groups:
+        name = group["_id"]["username"]
+        if current is None or current["_id"] != name:
+            if current is not None:
+                flush(current)
+                rebuilt += 1
+            current = {"_id": name, "count": 0, "total_score": 0, "total_time": 0,
+                       "subjects": {}, "updatedAt": datetime.datetime.utcnow()}
+        current["count"] += group["count"]
+        current["total_score"] += group["total_score"]
+        current["total_time"] += group["total_time"]
+        current["subjects"][subject_key(group["_id"]["subject"])] = {
+            "count": group["count"],
+            "total_score": group["total_score"],
+        }
+
+    if current is not None:
+        flush(current)
+        rebuilt += 1
+    if requests:
+        summaries.bulk_write(requests, ordered=False)
+    return rebuilt
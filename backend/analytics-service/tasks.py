@@ -1,45 +1,78 @@
-from celery_worker import celery
+from celery_worker import celery, ANALYTICS_QUEUE, record_queue_wait
 from pymongo import MongoClient
-from collections import defaultdict
+from summaries import SUMMARY_COLLECTION, insights_from_summary, rebuild_summaries
+from rollups import GRANULARITIES, rebuild_rollups
+from export import EXPORTS, export_collection
 import logging
+import os
+import redis
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@celery.task(name='tasks.generate_insights')
-def generate_insights(username):
-    logger.info(f"Processing insights for username: {username}")
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client["adaptive_lms"]
-    collection = db["performance_data"]
-    records = list(collection.find({"username": username}))
-    
-    if not records:
-        logger.info("No performance data found")
-        return {"error": "No performance data found"}
-
-    total_time = 0
-    total_score = 0
-    subject_scores = defaultdict(list)
-
-    for record in records:
-        score = record.get("score", 0)
-        time_taken = record.get("time_taken", 0)
-        subject = record.get("subject", "Unknown")
-
-        total_time += time_taken
-        total_score += score
-        subject_scores[subject].append(score)
-
-    avg_score = total_score / len(records)
-    most_attempted_subject = max(subject_scores.items(), key=lambda x: len(x[1]))[0]
-    weak_subjects = [subject for subject, scores in subject_scores.items() if sum(scores) / len(scores) < 50]
-
-    result = {
-        "average_score": round(avg_score, 2),
-        "total_time_spent": total_time,
-        "most_attempted_subject": most_attempted_subject,
-        "weak_subjects": weak_subjects
-    }
-    logger.info(f"Generated insights: {result}")
-    return result
\ No newline at end of file
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+
+# Connection to the broker's Redis, used for queue metrics
+broker_redis = redis.Redis.from_url(celery.conf.broker_url)
+
+# One pooled MongoClient per worker process. It is created on first use rather than
+# at import, because prefork workers fork after importing this module and a client
+# must not be shared across a fork.
+_mongo_client = None
+_mongo_client_pid = None
+
+def get_db():
+    global _mongo_client, _mongo_client_pid
+    if _mongo_client is None or _mongo_client_pid != os.getpid():
+        _mongo_client = MongoClient(MONGO_URI)
+        _mongo_client_pid = os.getpid()
+        # Lets the summary rebuild aggregation run from the index alone
+        _mongo_client["adaptive_lms"]["performance_data"].create_index(
+            [("username", 1), ("subject", 1), ("score", 1), ("time_taken", 1)]
+        )
+    return _mongo_client["adaptive_lms"]
+
+# Full rebuild of the materialized summaries from performance_data, for one user or
+# for everyone. Insights are served from the summaries, so this is only needed to
+# backfill or repair them.
+@celery.task(name='tasks.rebuild_summaries')
+def rebuild_summaries_task(username=None, enqueued_at=None):
+    logger.info(f"Rebuilding performance summaries for {username or 'all users'}")
+    try:
+        record_queue_wait(broker_redis, ANALYTICS_QUEUE, enqueued_at)
+    except Exception as e:
+        logger.error(f"Error recording queue wait: {str(e)}")
+    db = get_db()
+    rebuilt = rebuild_summaries(db, username)
+    logger.info(f"Rebuilt {rebuilt} performance summaries")
+
+    if username:
+        summary = db[SUMMARY_COLLECTION].find_one({"_id": username})
+        result = insights_from_summary(summary) if summary else None
+        return result or {"error": "No performance data found"}
+    return {"rebuilt": rebuilt}
+
+# Backfill of the time-bucketed rollups, for one user or everyone
+@celery.task(name='tasks.rebuild_rollups')
+def rebuild_rollups_task(username=None, granularities=None, enqueued_at=None):
+    logger.info(f"Rebuilding performance rollups for {username or 'all users'}")
+    try:
+        record_queue_wait(broker_redis, ANALYTICS_QUEUE, enqueued_at)
+    except Exception as e:
+        logger.error(f"Error recording queue wait: {str(e)}")
+    granularities = granularities or list(GRANULARITIES)
+    rebuild_rollups(get_db(), username, granularities)
+    logger.info(f"Rebuilt {', '.join(granularities)} rollups")
+    return {"username": username, "granularities": granularities}
+
+# Incremental columnar export of the analytics collections for offline analysis
+@celery.task(name='tasks.export_collections')
+def export_collections_task(collections=None, enqueued_at=None):
+    try:
+        record_queue_wait(broker_redis, ANALYTICS_QUEUE, enqueued_at)
+    except Exception as e:
+        logger.error(f"Error recording queue wait: {str(e)}")
+    db = get_db()
+    exported = {name: export_collection(db, name) for name in (collections or list(EXPORTS))}
+    logger.info(f"Exported rows: {exported}")
+    return {"exported": exported}
@@ -1,10 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import jwt
 from functools import wraps
 import requests
 from requests.exceptions import Timeout, RequestException
 import os
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,6 +30,14 @@ CONTENT_SERVICE = "http://content-service:5001"
 # ANALYTICS_SERVICE = "http://analytics-service:5003"
 QUIZ_SERVICE = "http://quiz-service:5004"
 
+# Response headers passed back to clients from service JSON responses
+PASSTHROUGH_HEADERS = ("ETag", "Cache-Control", "Vary")
+
+# Quiz versions are immutable, so the gateway keeps recently served ones in memory
+QUIZ_VERSION_CACHE_SIZE = int(os.getenv("QUIZ_VERSION_CACHE_SIZE", 500))
+quiz_version_cache = OrderedDict()
+quiz_version_cache_lock = threading.Lock()
+
 
 @app.route('/')
 def home():
@@ -35,7 +45,8 @@ def home():
 
 
 # JWT token validation with optional role restriction
-def token_required(allowed_roles=None):
+# allow_query_token lets EventSource clients, which cannot set headers, pass ?token=
+def token_required(allowed_roles=None, allow_query_token=False):
     def decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
@@ -46,6 +57,8 @@ def token_required(allowed_roles=None):
                 auth_header = request.headers['Authorization']
                 if auth_header.startswith("Bearer "):
                     token = auth_header.split(" ")[1]
+            elif allow_query_token:
+                token = request.args.get('token')
 
             if not token:
                 return jsonify({"error": "Token is missing!"}), 401
@@ -74,7 +87,7 @@ def token_required(allowed_roles=None):
 
 
 # Forwarding helper function to forward requests to respective services
-def forward_request(service_url, path):
+def forward_request(service_url, path, timeout=10):
     full_url = f"{service_url}/{path}"
     print(f"Forwarding to {full_url}")
     print(f"Method: {request.method}")
@@ -91,13 +104,13 @@ def forward_request(service_url, path):
 
     try:
         if request.method == 'GET':
-            resp = requests.get(full_url, headers=headers, params=request.args, timeout=10)
+            resp = requests.get(full_url, headers=headers, params=request.args, timeout=timeout)
         elif request.method == 'POST':
-            resp = requests.post(full_url, headers=headers, json=request.get_json(), timeout=10)
+            resp = requests.post(full_url, headers=headers, json=request.get_json(), timeout=timeout)
         elif request.method == 'PUT':
-            resp = requests.put(full_url, headers=headers, json=request.get_json(), timeout=10)
+            resp = requests.put(full_url, headers=headers, json=request.get_json(), timeout=timeout)
         elif request.method == 'DELETE':
-            resp = requests.delete(full_url, headers=headers, timeout=10)
+            resp = requests.delete(full_url, headers=headers, timeout=timeout)
         elif request.method == 'OPTIONS':
             return "", 200  # Handle OPTIONS preflight directly
         else:
@@ -110,10 +123,14 @@ def forward_request(service_url, path):
         # Check for errors
         resp.raise_for_status()
         
+        passthrough = {name: resp.headers[name] for name in PASSTHROUGH_HEADERS if name in resp.headers}
+        if resp.status_code == 304:
+            return "", 304, passthrough
+        
         # Return the response based on content type
         content_type = resp.headers.get('Content-Type', '')
         if 'application/json' in content_type and resp.text:
-            return jsonify(resp.json()), resp.status_code
+            return jsonify(resp.json()), resp.status_code, passthrough
         else:
             # Pass through non-JSON responses as-is
             return resp.text, resp.status_code, dict(resp.headers)
@@ -130,6 +147,28 @@ def forward_request(service_url, path):
         return jsonify({"error": str(e)}), 500
 
 
+# Streaming helper for long-lived responses such as server-sent events
+def stream_request(service_url, path):
+    full_url = f"{service_url}/{path}"
+    print(f"Streaming from {full_url}")
+
+    params = {key: value for key, value in request.args.items() if key != 'token'}
+    try:
+        # The service sends a keepalive every 15 seconds, so a longer gap means it is gone
+        resp = requests.get(full_url, params=params, stream=True, timeout=(5, 60))
+        resp.raise_for_status()
+    except RequestException as e:
+        print(f"Stream request failed: {str(e)}")
+        return jsonify({"error": f"Request failed: {str(e)}"}), 502
+
+    return Response(
+        stream_with_context(resp.iter_content(chunk_size=None)),
+        status=resp.status_code,
+        content_type=resp.headers.get('Content-Type', 'text/event-stream'),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ----------- UNAUTHENTICATED ROUTES FOR REGISTER & LOGIN -----------
 
 # These routes should not require authentication, so no token_required decorator
@@ -304,6 +343,50 @@ def get_quiz(quiz_id):
     
     return protected_route()
 
+# Serve an immutable quiz version, from the gateway's cache when possible
+def forward_quiz_version(quiz_id, version):
+    attempt_seed = request.args.get('attemptSeed')
+    if request.args.get('shuffle') and not attempt_seed:
+        # A fresh shuffle is different on every request
+        return forward_request(QUIZ_SERVICE, f'quiz/{quiz_id}/versions/{version}')
+    
+    # Teachers see the answers, students get the student view, so cache them apart
+    is_teacher = request.user.get("role") in ("admin", "teacher")
+    cache_key = (quiz_id, version, is_teacher, attempt_seed)
+    with quiz_version_cache_lock:
+        cached = quiz_version_cache.get(cache_key)
+        if cached is not None:
+            quiz_version_cache.move_to_end(cache_key)
+    
+    if cached is None:
+        result = forward_request(QUIZ_SERVICE, f'quiz/{quiz_id}/versions/{version}')
+        # Only cache full JSON bodies; errors and 304s go straight back to the client
+        if len(result) != 3 or result[1] != 200 or not isinstance(result[0], Response):
+            return result
+        response, _, headers = result
+        cached = (response.get_data(), headers)
+        with quiz_version_cache_lock:
+            quiz_version_cache[cache_key] = cached
+            while len(quiz_version_cache) > QUIZ_VERSION_CACHE_SIZE:
+                quiz_version_cache.popitem(last=False)
+    
+    body, headers = cached
+    etag = headers.get("ETag", "").strip('"')
+    if etag and request.if_none_match.contains(etag):
+        return "", 304, headers
+    return Response(body, status=200, content_type='application/json', headers=headers)
+
+@app.route('/quiz/quiz/<quiz_id>/versions/<version>', methods=['GET', 'OPTIONS'])
+def get_quiz_version(quiz_id, version):
+    if request.method == 'OPTIONS':
+        return '', 200  # Handle OPTIONS preflight directly
+    
+    @token_required(allowed_roles=["admin", "teacher", "student"])
+    def protected_route(*args, **kwargs):
+        return forward_quiz_version(quiz_id, version)
+    
+    return protected_route()
+
 @app.route('/quiz/submit-quiz', methods=['POST', 'OPTIONS'])
 def submit_quiz():
     if request.method == 'OPTIONS':
@@ -322,7 +405,20 @@ def feedback_status(task_id):
     
     @token_required(allowed_roles=["student"])
     def protected_route(*args, **kwargs):
-        return forward_request(QUIZ_SERVICE, f'feedback-status/{task_id}')
+        # Long-poll requests (?wait=N) are held by the quiz service for up to N seconds
+        wait = request.args.get('wait', 0, type=int)
+        return forward_request(QUIZ_SERVICE, f'feedback-status/{task_id}', timeout=10 + max(wait, 0))
+    
+    return protected_route()
+
+@app.route('/quiz/feedback-stream/<task_id>', methods=['GET', 'OPTIONS'])
+def feedback_stream(task_id):
+    if request.method == 'OPTIONS':
+        return '', 200  # Handle OPTIONS preflight directly
+    
+    @token_required(allowed_roles=["student"], allow_query_token=True)
+    def protected_route(*args, **kwargs):
+        return stream_request(QUIZ_SERVICE, f'feedback-stream/{task_id}')
     
     return protected_route()
 
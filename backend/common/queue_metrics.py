@@ -0,0 +1,54 @@
+"""
+Queue depth and wait-time metrics shared by the services' Celery workers.
+
+Pass a connection to the Redis the queue lives on: the Celery broker for Celery
+queues, and the application Redis for plain job lists.
+"""
+import time
+
+QUEUE_METRICS_SAMPLES = 1000  # recent wait times kept per queue for percentiles
+PRIORITY_STEPS = 10
+
+def queue_depth(redis_conn, queue, priority=True):
+    """Messages waiting in a queue, summed over its priority lists for Celery queues"""
+    if not priority:
+        return redis_conn.llen(queue)
+    pipe = redis_conn.pipeline()
+    pipe.llen(queue)
+    for step in range(1, PRIORITY_STEPS):
+        pipe.llen(f"{queue}:{step}")
+    return sum(pipe.execute())
+
+def record_queue_wait(redis_conn, queue, enqueued_at):
+    """Record how long a task sat in its queue before a worker started it"""
+    if not enqueued_at:
+        return
+    wait = max(0.0, time.time() - enqueued_at)
+    pipe = redis_conn.pipeline()
+    pipe.hincrby(f"queue_metrics:{queue}", "count", 1)
+    pipe.hincrbyfloat(f"queue_metrics:{queue}", "wait_total", wait)
+    pipe.lpush(f"queue_metrics:{queue}:waits", round(wait, 3))
+    pipe.ltrim(f"queue_metrics:{queue}:waits", 0, QUEUE_METRICS_SAMPLES - 1)
+    pipe.execute()
+
+def queue_metrics(redis_conn, queue, priority=True):
+    """Depth and wait-time statistics for a queue"""
+    pipe = redis_conn.pipeline()
+    pipe.hgetall(f"queue_metrics:{queue}")
+    pipe.lrange(f"queue_metrics:{queue}:waits", 0, -1)
+    totals, samples = pipe.execute()
+
+    count = int(totals.get(b"count", 0))
+    waits = sorted(float(sample) for sample in samples)
+    def pct(p):
+        return waits[min(len(waits) - 1, int(p / 100 * len(waits)))] if waits else 0.0
+
+    return {
+        "queue": queue,
+        "depth": queue_depth(redis_conn, queue, priority),
+        "tasks_started": count,
+        "avg_wait_seconds": round(float(totals.get(b"wait_total", 0)) / count, 3) if count else 0.0,
+        "p50_wait_seconds": pct(50),
+        "p95_wait_seconds": pct(95),
+        "max_recent_wait_seconds": waits[-1] if waits else 0.0,
+    }
@@ -1,6 +1,6 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from bson import ObjectId, json_util
 import json
 import os
@@ -15,6 +15,21 @@ CORS(app, resources={r"/*": {"origins": "*", "supports_credentials": True, "allo
 client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
 db = client["adaptive_lms"]
 content_collection = db["content"]
+counter_collection = db["counters"]
+
+# Every write stamps the item with the next catalog version, so consumers such as
+# the adaptive engine can ask for just what changed since the version they hold
+CONTENT_VERSION_COUNTER = "content_version"
+content_collection.create_index("version")
+
+def next_content_version():
+    counter = counter_collection.find_one_and_update(
+        {"_id": CONTENT_VERSION_COUNTER},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
 
 # Helper function to convert MongoDB data to JSON
 def parse_json(data):
@@ -43,6 +58,7 @@ def add_content():
         return jsonify({"error": "Missing fields"}), 400
     
     try:
+        data["version"] = next_content_version()
         result = content_collection.insert_one(data)  # Insert new content into the database
         # Return the created content including the MongoDB ID
         created_content = data.copy()
@@ -75,6 +91,26 @@ def get_content():
     except Exception as e:
         return jsonify({"error": str(e)}), 500  # Handle potential database errors
 
+# Content written after a catalog version, oldest first. since=0 returns the whole
+# catalog, including items from before versions existed.
+@app.route('/content-changes', methods=['GET'])
+def content_changes():
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+
+    try:
+        query = {"version": {"$gt": since}} if since > 0 else {}
+        items = list(content_collection.find(query).sort("version", 1))
+        for item in items:
+            item["_id"] = str(item["_id"])
+        # The version to ask from next time: the newest returned, or the same one if nothing changed
+        version = max([since] + [item.get("version", 0) for item in items])
+        return jsonify({"version": version, "items": items}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # Handle specific content item retrieval
 @app.route('/content/<content_id>', methods=['GET'])
 def get_specific_content(content_id):
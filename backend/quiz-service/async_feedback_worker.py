@@ -0,0 +1,135 @@
+"""
+Asyncio feedback worker.
+
+Runs many Gemini calls concurrently in a single process instead of one call per
+Celery worker slot. Start it with FEEDBACK_WORKER_MODE=asyncio set on both the
+quiz service and this worker:
+
+    python async_feedback_worker.py
+
+Jobs are pulled from the FEEDBACK_JOB_QUEUE Redis list. Each job is moved to a
+per-worker processing list while it runs, so a crashed worker picks its
+unfinished jobs back up on restart. Results are written to the Celery result
+backend under the job's task ID, so /feedback-status works the same in both modes.
+"""
+import asyncio
+import json
+import logging
+import socket
+import time
+
+from app import (
+    celery,
+    redis_client,
+    BENCHMARK_QUIZ_ID,
+    FEEDBACK_JOB_QUEUE,
+    FEEDBACK_CONCURRENCY,
+    FEEDBACK_PRIORITY_DEFAULT,
+    MAX_RETRIES,
+    build_feedback_prompt,
+    create_fallback_feedback,
+    estimate_gemini_tokens,
+    feedback_retry_delay,
+    get_feedback_backend,
+    store_feedback,
+    try_acquire_gemini_quota,
+)
+from celery_worker import record_queue_wait
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROCESSING_QUEUE = f"{FEEDBACK_JOB_QUEUE}:processing:{socket.gethostname()}"
+POLL_TIMEOUT = 5  # seconds to block waiting for a job before checking again
+
+async def wait_for_quota(job, prompt):
+    """Sleep until the shared Gemini quota lets this job make its call"""
+    estimated_tokens = estimate_gemini_tokens(prompt)
+    priority = job.get("priority", FEEDBACK_PRIORITY_DEFAULT)
+    while True:
+        wait_ms = await asyncio.to_thread(try_acquire_gemini_quota, job["task_id"], estimated_tokens, priority)
+        if not wait_ms:
+            return
+        await asyncio.sleep(wait_ms / 1000)
+
+async def generate_feedback(job, semaphore, timings):
+    try:
+        prompt = build_feedback_prompt(job["username"], job["wrong_questions"], job["subject"], job["level"])
+    except Exception as e:
+        # Retrying cannot help a question the prompt cannot be built from
+        logger.error(f"Could not build feedback prompt for task {job['task_id']}: {str(e)}")
+        timings["startedAt"] = time.time()
+        return create_fallback_feedback(job["wrong_questions"])
+    backend = get_feedback_backend()
+
+    for attempt in range(MAX_RETRIES):
+        if backend.uses_gemini_quota:
+            await wait_for_quota(job, prompt)
+        timings["startedAt"] = time.time()
+        try:
+            # Only the model call holds a slot, so jobs backing off don't block others
+            async with semaphore:
+                logger.info(f"Generating feedback for task {job['task_id']} (attempt {attempt+1})")
+                return await backend.generate_async(prompt, job["wrong_questions"])
+        except Exception as api_error:
+            error_message = str(api_error)
+            logger.error(f"Feedback backend error for task {job['task_id']}: {error_message}")
+            if attempt + 1 < MAX_RETRIES:
+                delay = feedback_retry_delay(error_message, attempt + 1)
+                logger.warning(f"Retrying task {job['task_id']} in {delay} seconds")
+                await asyncio.sleep(delay)
+
+    logger.info(f"Used fallback feedback generation for task {job['task_id']}")
+    return create_fallback_feedback(job["wrong_questions"])
+
+async def process_job(raw_job, semaphore):
+    try:
+        job = json.loads(raw_job)
+        benchmark = job["quiz_id"] == BENCHMARK_QUIZ_ID
+        if not benchmark:
+            await asyncio.to_thread(record_queue_wait, redis_client, FEEDBACK_JOB_QUEUE, job.get("enqueued_at"))
+        timings = {"enqueuedAt": job.get("enqueued_at")}
+        feedback = await generate_feedback(job, semaphore, timings)
+        timings["completedAt"] = time.time()
+
+        # Mongo and Redis clients are blocking, keep them off the event loop
+        await asyncio.to_thread(store_feedback, job["quiz_id"], job["username"], feedback, job.get("result_id"), job["task_id"], timings)
+        if not benchmark:
+            await asyncio.to_thread(celery.backend.store_result, job["task_id"], feedback, "SUCCESS")
+        logger.info(f"Completed feedback task {job['task_id']}")
+    except Exception as e:
+        logger.error(f"Error processing feedback job: {str(e)}")
+    finally:
+        await asyncio.to_thread(redis_client.lrem, PROCESSING_QUEUE, 1, raw_job)
+
+def requeue_unfinished_jobs():
+    """Push jobs left in this worker's processing list by a previous run back onto the queue"""
+    requeued = 0
+    while redis_client.rpoplpush(PROCESSING_QUEUE, FEEDBACK_JOB_QUEUE):
+        requeued += 1
+    if requeued:
+        logger.info(f"Requeued {requeued} unfinished feedback jobs")
+
+async def main():
+    requeue_unfinished_jobs()
+
+    semaphore = asyncio.Semaphore(FEEDBACK_CONCURRENCY)
+    in_flight = set()
+    # Cap jobs held by this process, including ones waiting out a retry backoff
+    max_pending = FEEDBACK_CONCURRENCY * 2
+    logger.info(f"Async feedback worker started with {FEEDBACK_CONCURRENCY} concurrent calls")
+
+    while True:
+        if len(in_flight) >= max_pending:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+        raw_job = await asyncio.to_thread(redis_client.brpoplpush, FEEDBACK_JOB_QUEUE, PROCESSING_QUEUE, POLL_TIMEOUT)
+        if raw_job is None:
+            continue
+
+        task = asyncio.create_task(process_job(raw_job, semaphore))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+if __name__ == '__main__':
+    asyncio.run(main())
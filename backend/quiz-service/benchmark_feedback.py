@@ -0,0 +1,100 @@
+"""
+Load test for the submission-to-feedback pipeline.
+
+Enqueues feedback jobs through dispatch_feedback, the same path submit_quiz_result
+uses, and listens for their completion events on Redis pub/sub. Start the workers
+with the stub backend so no Gemini quota is used, e.g.
+
+    FEEDBACK_BACKEND=stub FEEDBACK_STUB_LATENCY=0.5 celery -A celery_worker worker
+    python benchmark_feedback.py --tasks 500
+
+Reports completed tasks per second, queue latency (enqueue until the backend call
+started) and end-to-end latency (enqueue until feedback was published).
+
+Jobs are dispatched for BENCHMARK_QUIZ_ID, whose feedback store_feedback only
+publishes: nothing is written to quiz_results, no feedback:<task_id> keys are
+cached, no task results are stored and the queue wait metrics are not fed.
+"""
+import argparse
+import json
+import time
+
+from app import redis_client, dispatch_feedback, BENCHMARK_QUIZ_ID, FEEDBACK_CHANNEL_PREFIX
+
+SAMPLE_WRONG_QUESTIONS = [
+    {
+        "question": "What is 7 x 8?",
+        "choices": ["54", "56", "58", "64"],
+        "correctAnswer": 1,
+        "userAnswer": 0
+    },
+    {
+        "question": "Which of these is a prime number?",
+        "choices": ["21", "27", "29", "33"],
+        "correctAnswer": 2,
+        "userAnswer": 3
+    }
+]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(name, values):
+    return (f"{name}: p50={percentile(values, 50) * 1000:.0f}ms "
+            f"p95={percentile(values, 95) * 1000:.0f}ms "
+            f"p99={percentile(values, 99) * 1000:.0f}ms "
+            f"max={max(values, default=0) * 1000:.0f}ms")
+
+def run(task_count, rate, timeout):
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(f"{FEEDBACK_CHANNEL_PREFIX}*")
+
+    pending = set()
+    started = time.time()
+    for i in range(task_count):
+        task_id = dispatch_feedback(BENCHMARK_QUIZ_ID, f"benchmark-user-{i}", SAMPLE_WRONG_QUESTIONS, "Mathematics", "Beginner")
+        pending.add(task_id)
+        if rate:
+            time.sleep(1 / rate)
+    enqueue_done = time.time()
+    print(f"Enqueued {task_count} tasks in {enqueue_done - started:.2f}s")
+
+    queue_latencies = []
+    total_latencies = []
+    last_completed = started
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        message = pubsub.get_message(timeout=1.0)
+        if not message:
+            continue
+        task_id = message["channel"].decode().split(FEEDBACK_CHANNEL_PREFIX, 1)[1]
+        if task_id not in pending:
+            continue
+        pending.discard(task_id)
+
+        event = json.loads(message["data"])
+        if event.get("enqueuedAt") and event.get("startedAt"):
+            queue_latencies.append(event["startedAt"] - event["enqueuedAt"])
+            total_latencies.append(event["completedAt"] - event["enqueuedAt"])
+        last_completed = time.time()
+    pubsub.close()
+
+    completed = task_count - len(pending)
+    elapsed = max(last_completed - started, 1e-9)
+    print(f"Completed {completed}/{task_count} tasks in {elapsed:.2f}s ({completed / elapsed:.1f} tasks/s)")
+    if pending:
+        print(f"{len(pending)} tasks did not finish within {timeout}s")
+    print(summarize("Queue latency", queue_latencies))
+    print(summarize("End-to-end latency", total_latencies))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the feedback pipeline")
+    parser.add_argument("--tasks", type=int, default=200, help="number of feedback jobs to enqueue")
+    parser.add_argument("--rate", type=float, default=0, help="jobs per second to enqueue at (0 = all at once)")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for completion")
+    args = parser.parse_args()
+    run(args.tasks, args.rate, args.timeout)
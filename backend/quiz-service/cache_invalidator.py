@@ -0,0 +1,168 @@
+"""
+Cache invalidation daemon driven by MongoDB change streams.
+
+Tails changes to quizzes, quiz_results and content and turns each one into
+targeted Redis evictions plus a pub/sub notification, so writes that bypass the
+quiz service (admin scripts, imports, mongosh) no longer leave stale caches.
+
+    python cache_invalidator.py [--from-now]
+
+Change streams need a replica set. For a local single-node one:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0
+    mongosh --eval "rs.initiate()"
+    MONGO_URI="mongodb://localhost:27017/?directConnection=true" REDIS_URL=redis://localhost:6379/0 python cache_invalidator.py
+
+The resume token is saved in Redis after every change, so a restart picks up
+where the previous run stopped; --from-now discards it.
+"""
+import argparse
+import json
+import logging
+import time
+
+from bson import json_util
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app import (
+    db,
+    quiz_collection,
+    redis_client,
+    save_quiz_version,
+    user_results_cache_keys,
+    QUIZ_CACHE_TTL,
+    QUIZ_METADATA_FIELDS,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ("quizzes", "quiz_results", "content")
+RESUME_TOKEN_KEY = "cache_invalidator:resume_token"
+RESTART_DELAY = 5  # seconds to wait before reopening a failed change stream
+CHANGE_STREAM_HISTORY_LOST = 286
+
+# Pub/sub channels other services can subscribe to
+CHANNELS = {
+    "quizzes": "quiz_changed",
+    "quiz_results": "quiz_result_changed",
+    "content": "content_changed",
+}
+
+def delete_matching(pattern):
+    """Delete every key matching a pattern, using SCAN so Redis is never blocked"""
+    keys = list(redis_client.scan_iter(match=pattern, count=1000))
+    if keys:
+        redis_client.delete(*keys)
+    return len(keys)
+
+def changed_fields(change):
+    update = change.get("updateDescription") or {}
+    fields = list(update.get("updatedFields", {})) + list(update.get("removedFields", []))
+    return {field.split(".", 1)[0] for field in fields}
+
+def handle_quiz_change(change):
+    quiz_id = str(change["documentKey"]["_id"])
+    operation = change["operationType"]
+    quiz = change.get("fullDocument")
+
+    # A direct edit to the questions must become a new version, otherwise the
+    # quiz would keep pointing at content it no longer has
+    content_changed = operation in ("insert", "replace") or bool(changed_fields(change) - set(QUIZ_METADATA_FIELDS))
+    version = quiz.get("currentVersion") if quiz else None
+    if quiz and quiz.get("deleted"):
+        version = None
+        redis_client.delete(f"quiz_current:{quiz_id}")
+    elif quiz and content_changed:
+        version = save_quiz_version(quiz_id, quiz)
+        if version != quiz.get("currentVersion"):
+            quiz_collection.update_one({"_id": quiz["_id"]}, {"$set": {"currentVersion": version}})
+            logger.info(f"Quiz {quiz_id} changed outside the quiz service, now at version {version}")
+        redis_client.setex(f"quiz_current:{quiz_id}", QUIZ_CACHE_TTL, version)
+    else:
+        redis_client.delete(f"quiz_current:{quiz_id}")
+
+    evicted = delete_matching("quiz_listing:*")
+    return {"quizId": quiz_id, "version": version}, evicted
+
+def handle_quiz_result_change(change):
+    result = change.get("fullDocument") or {}
+    username = result.get("username")
+    evicted = 0
+    # Deletes carry no username and arrive in batches of hundreds from the quiz
+    # purge, which evicts the affected users itself once per batch
+    if change["operationType"] != "delete" and username:
+        evicted = redis_client.delete(*user_results_cache_keys([username]))
+    return {"resultId": str(change["documentKey"]["_id"]), "username": username,
+            "quizId": result.get("quizId")}, evicted
+
+def handle_content_change(change):
+    content = change.get("fullDocument") or {}
+    # Content has no cache of its own here; subscribers (the adaptive engine) refresh from the event
+    return {"contentId": str(change["documentKey"]["_id"]),
+            "subject": content.get("subject"), "level": content.get("level")}, 0
+
+HANDLERS = {
+    "quizzes": handle_quiz_change,
+    "quiz_results": handle_quiz_result_change,
+    "content": handle_content_change,
+}
+
+def handle_change(change):
+    collection = change["ns"]["coll"]
+    event, evicted = HANDLERS[collection](change)
+    event["operation"] = change["operationType"]
+    redis_client.publish(CHANNELS[collection], json.dumps(event))
+    logger.info(f"{collection} {change['operationType']} {change['documentKey']['_id']}: evicted {evicted} keys")
+
+def flush_all():
+    """Drop every cache the daemon is responsible for, used when changes may have been missed"""
+    patterns = ("quiz_current:*", "quiz_listing:*", "user_results:*")
+    evicted = sum(delete_matching(pattern) for pattern in patterns)
+    logger.warning(f"Change history lost, flushed {evicted} cached keys")
+
+def load_resume_token():
+    token = redis_client.get(RESUME_TOKEN_KEY)
+    return json_util.loads(token) if token else None
+
+def save_resume_token(token):
+    redis_client.set(RESUME_TOKEN_KEY, json_util.dumps(token))
+
+def run(from_now=False):
+    if from_now:
+        redis_client.delete(RESUME_TOKEN_KEY)
+
+    pipeline = [
+        {"$match": {
+            "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}
+    ]
+
+    while True:
+        resume_token = load_resume_token()
+        try:
+            with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                logger.info(f"Watching {', '.join(WATCHED_COLLECTIONS)}" + (" from saved position" if resume_token else ""))
+                for change in stream:
+                    try:
+                        handle_change(change)
+                    except Exception as e:
+                        # A bad event must not stall the stream; its keys still expire by TTL
+                        logger.error(f"Failed to handle change {change.get('documentKey')}: {str(e)}")
+                    save_resume_token(stream.resume_token)
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                redis_client.delete(RESUME_TOKEN_KEY)
+                flush_all()
+                continue
+            logger.error(f"Change stream failed: {str(e)}")
+        except PyMongoError as e:
+            logger.error(f"Change stream failed: {str(e)}")
+        time.sleep(RESTART_DELAY)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Invalidate Redis caches from MongoDB change streams")
+    parser.add_argument("--from-now", action="store_true", help="ignore the saved resume token")
+    args = parser.parse_args()
+    run(from_now=args.from_now)
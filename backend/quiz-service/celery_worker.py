@@ -1,12 +1,26 @@
 import os
+import sys
 from celery import Celery
 from dotenv import load_dotenv
+from kombu import Queue
+
+try:
+    from common.queue_metrics import queue_metrics, record_queue_wait
+except ImportError:
+    # Running from the source tree: common/ sits next to the service directory
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from common.queue_metrics import queue_metrics, record_queue_wait
 
 load_dotenv()
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
 
+# Feedback tasks get their own queue so slow Gemini calls never sit behind other work
+FEEDBACK_QUEUE = "feedback"
+# Slow background housekeeping such as purging a deleted quiz's results
+MAINTENANCE_QUEUE = "maintenance"
+
 # Create Celery app
 celery = Celery(
     'quiz_tasks',
@@ -14,8 +28,27 @@ celery = Celery(
     backend=CELERY_RESULT_BACKEND
 )
 
+celery.conf.update(
+    task_queues=(Queue(FEEDBACK_QUEUE), Queue(MAINTENANCE_QUEUE)),
+    task_default_queue=FEEDBACK_QUEUE,
+    task_routes={
+        'generate_ai_feedback': {'queue': FEEDBACK_QUEUE},
+        'purge_quiz_results': {'queue': MAINTENANCE_QUEUE},
+    },
+    # Redis emulates priorities with one list per level; 0 is served first
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+    task_default_priority=5,
+    # Fetch one message at a time so a high priority task is not stuck behind prefetched ones
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+)
+
 # Include the task modules explicitly
 celery.conf.imports = ['app']
 
 if __name__ == '__main__':
-    celery.start() 
\ No newline at end of file
+    celery.start()
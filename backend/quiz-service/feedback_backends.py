@@ -0,0 +1,122 @@
+"""
+Feedback generation backends.
+
+FEEDBACK_BACKEND selects how quiz feedback is written:
+  gemini   - Google Gemini (default)
+  template - the canned feedback also used when Gemini is unavailable
+  stub     - a local fake with configurable latency and error rate, for load
+             testing the submission-to-feedback pipeline without network or quota
+"""
+import asyncio
+import hashlib
+import random
+import time
+
+class FeedbackBackend:
+    """Turns a tutor prompt and the wrongly answered questions into feedback text"""
+
+    # Whether calls must go through the shared Gemini quota governor
+    uses_gemini_quota = False
+
+    def generate(self, prompt, wrong_questions):
+        raise NotImplementedError
+
+    async def generate_async(self, prompt, wrong_questions):
+        return await asyncio.to_thread(self.generate, prompt, wrong_questions)
+
+class GeminiBackend(FeedbackBackend):
+    uses_gemini_quota = True
+
+    def __init__(self, model_name, api_key, safety_settings=None, generation_config=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(
+            model_name,
+            safety_settings=safety_settings,
+            generation_config=generation_config
+        )
+
+    def generate(self, prompt, wrong_questions):
+        return self.model.generate_content(prompt).text
+
+    async def generate_async(self, prompt, wrong_questions):
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+class TemplateBackend(FeedbackBackend):
+    def generate(self, prompt, wrong_questions):
+        return create_fallback_feedback(wrong_questions)
+
+class StubBackendError(Exception):
+    pass
+
+class StubBackend(FeedbackBackend):
+    """
+    Deterministic stand-in for Gemini. Each call sleeps for `latency` seconds
+    (plus up to `jitter`), fails with a simulated rate limit error at `error_rate`,
+    and otherwise returns text derived only from the prompt. Latencies and failures
+    come from a seeded generator, so a benchmark run can be repeated exactly.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def _next_call(self):
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        fails = self.rng.random() < self.error_rate
+        return delay, fails
+
+    def _respond(self, prompt, wrong_questions, fails):
+        if fails:
+            raise StubBackendError("Simulated rate limit: quota exceeded")
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+        return f"Stub feedback for {len(wrong_questions)} incorrect answers (prompt {digest})"
+
+    def generate(self, prompt, wrong_questions):
+        delay, fails = self._next_call()
+        time.sleep(delay)
+        return self._respond(prompt, wrong_questions, fails)
+
+    async def generate_async(self, prompt, wrong_questions):
+        delay, fails = self._next_call()
+        await asyncio.sleep(delay)
+        return self._respond(prompt, wrong_questions, fails)
+
+def create_feedback_backend(name, **options):
+    if name == "gemini":
+        return GeminiBackend(**options)
+    if name == "template":
+        return TemplateBackend()
+    if name == "stub":
+        return StubBackend(**options)
+    raise ValueError(f"Unknown feedback backend: {name}")
+
+def choice_text(choices, index, default="No answer"):
+    """The text of a choice, or the default for anything that is not a valid choice index"""
+    if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < len(choices):
+        return choices[index]
+    return default
+
+def create_fallback_feedback(wrong_questions):
+    """Create basic feedback without using AI when API calls fail"""
+    feedback = "Feedback on your quiz results:\n\n"
+
+    for i, q in enumerate(wrong_questions):
+        correct_choice = choice_text(q.get("choices") or [], q.get("correctAnswer"), "Unknown")
+        user_choice = choice_text(q.get("choices") or [], q.get("userAnswer"))
+
+        feedback += f"Question {i+1}: {q.get('question', '')}\n"
+        feedback += f"Your answer: {user_choice}\n"
+        feedback += f"Correct answer: {correct_choice}\n"
+        feedback += "Review this concept for a better understanding.\n\n"
+
+    feedback += "\nGeneral study recommendations:\n"
+    feedback += "1. Review your class notes on these topics\n"
+    feedback += "2. Practice more questions in the areas where you made mistakes\n"
+    feedback += "3. Consider asking your teacher for additional resources\n"
+
+    return feedback
@@ -0,0 +1,67 @@
+"""
+Rebuild the quiz and subject leaderboards from quiz_results, e.g. after a Redis flush.
+
+    python rebuild_leaderboards.py [--reset]
+
+Best scores per (quiz, user) are computed by MongoDB in one aggregation and written
+to Redis in pipelined batches. ZADD GT is used, so running this alongside live
+submissions never lowers a score; --reset clears the existing leaderboards first.
+ZADD GT needs Redis 6.2 or newer.
+"""
+import argparse
+import logging
+
+from app import (
+    quiz_collection,
+    quiz_results_collection,
+    redis_client,
+    record_best_score,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+def rebuild(reset=False):
+    if reset:
+        deleted = 0
+        cursor = 0
+        while True:
+            # One UNLINK per SCAN page; the memory is freed in the background
+            cursor, keys = redis_client.scan(cursor, match="leaderboard:*", count=1000)
+            if keys:
+                deleted += redis_client.unlink(*keys)
+            if cursor == 0:
+                break
+        logger.info(f"Cleared {deleted} leaderboards")
+
+    # Older results don't store their subject, so take it from the quiz
+    # Deleted quizzes no longer count towards any leaderboard
+    quiz_subjects = {str(quiz["_id"]): quiz.get("subject")
+                     for quiz in quiz_collection.find({"deleted": {"$ne": True}}, {"subject": 1})}
+
+    best_scores = quiz_results_collection.aggregate([
+        {"$group": {"_id": {"quizId": "$quizId", "username": "$username"}, "score": {"$max": "$score"}}}
+    ], allowDiskUse=True)
+
+    pipe = redis_client.pipeline(transaction=False)
+    written = 0
+    for entry in best_scores:
+        quiz_id = entry["_id"]["quizId"]
+        subject = quiz_subjects.get(quiz_id)
+        if subject is None:
+            continue
+        record_best_score(pipe, quiz_id, subject, entry["_id"]["username"], entry["score"])
+        written += 1
+        if written % BATCH_SIZE == 0:
+            pipe.execute()
+            logger.info(f"Wrote {written} best scores")
+    pipe.execute()
+    logger.info(f"Rebuilt leaderboards from {written} best scores")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild quiz and subject leaderboards from MongoDB")
+    parser.add_argument("--reset", action="store_true", help="delete existing leaderboards before rebuilding")
+    args = parser.parse_args()
+    rebuild(reset=args.reset)
@@ -137,7 +137,7 @@ const QuizList = ({ onSelectQuiz, userData, onEditQuiz }) => {
                             <div className="quiz-info">
                                 <p><strong>Subject:</strong> {quiz.subject}</p>
                                 <p><strong>Level:</strong> {quiz.level}</p>
-                                <p><strong>Questions:</strong> {quiz.questions.length}</p>
+                                <p><strong>Questions:</strong> {quiz.questionCount ?? quiz.questions?.length ?? 0}</p>
                             </div>
                             <div className="quiz-actions">
                                 <button className="take-quiz-btn">Take Quiz</button>
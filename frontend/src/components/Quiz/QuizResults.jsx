@@ -112,7 +112,8 @@ const QuizResults = ({ username, latestResult }) => {
         try {
             setFeedbackLoading(true);
             console.log("Checking feedback status for task:", taskId);
-            const response = await quizApi.getFeedbackStatus(taskId);
+            // The server holds this request until the feedback is published or 25 seconds pass
+            const response = await quizApi.getFeedbackStatus(taskId, 25);
             console.log("Feedback status response:", response.data);
 
             if (response.data.status === 'completed') {
@@ -142,9 +143,9 @@ const QuizResults = ({ username, latestResult }) => {
 
                 setFeedbackLoading(false);
             } else if (response.data.status === 'processing') {
-                // Feedback still processing, poll again in 3 seconds
-                console.log("Feedback still processing, will check again in 3 seconds");
-                setTimeout(() => checkFeedbackStatus(taskId), 3000);
+                // The long-poll timed out before feedback was ready, wait on it again
+                console.log("Feedback still processing, waiting again");
+                checkFeedbackStatus(taskId);
             } else {
                 // Something went wrong, set a generic message
                 console.log("Feedback status error:", response.data);
@@ -2,7 +2,9 @@ import React, { useState, useEffect } from 'react';
 import quizApi from '../../services/quizApi';
 import './Quiz.css';
 
-const TakeQuiz = ({ quiz, username, userId, onQuizComplete, onBack }) => {
+const TakeQuiz = ({ quiz: listedQuiz, username, userId, onQuizComplete, onBack }) => {
+    // The listing has no questions, the attempt is loaded from the quiz's current version
+    const [quiz, setQuiz] = useState(null);
     const [currentQuestion, setCurrentQuestion] = useState(0);
     const [answers, setAnswers] = useState([]);
     const [loading, setLoading] = useState(false);
@@ -10,9 +12,21 @@ const TakeQuiz = ({ quiz, username, userId, onQuizComplete, onBack }) => {
     const [quizResult, setQuizResult] = useState(null);
 
     useEffect(() => {
-        // Initialize answers array with nulls (no answer selected)
-        setAnswers(new Array(quiz.questions.length).fill(null));
-    }, [quiz]);
+        const fetchQuiz = async () => {
+            try {
+                const response = await quizApi.getQuiz(listedQuiz._id);
+                setQuiz(response.data);
+                setCurrentQuestion(0);
+                // Initialize answers array with nulls (no answer selected)
+                setAnswers(new Array(response.data.questions.length).fill(null));
+                setError('');
+            } catch (err) {
+                setError(err.response?.data?.error || 'Failed to load quiz. Please try again.');
+            }
+        };
+        setQuiz(null);
+        fetchQuiz();
+    }, [listedQuiz]);
 
     const handleAnswerSelect = (questionIndex, choiceIndex) => {
         const newAnswers = [...answers];
@@ -45,6 +59,8 @@ const TakeQuiz = ({ quiz, username, userId, onQuizComplete, onBack }) => {
         try {
             const response = await quizApi.submitQuiz({
                 quizId: quiz._id,
+                quizVersion: quiz.version,
+                attemptSeed: quiz.attemptSeed,
                 userId: userId,
                 username: username,
                 answers: answers
@@ -88,6 +104,20 @@ const TakeQuiz = ({ quiz, username, userId, onQuizComplete, onBack }) => {
         );
     }
 
+    if (!quiz) {
+        return (
+            <div className="take-quiz-container">
+                <h3>{listedQuiz.title}</h3>
+                {error ? <div className="error-message">{error}</div> : <div className="loading">Loading quiz...</div>}
+                <div className="action-buttons">
+                    <button className="back-btn" onClick={onBack}>
+                        Return to Quizzes
+                    </button>
+                </div>
+            </div>
+        );
+    }
+
     const currentQuestionData = quiz.questions[currentQuestion];
 
     return (
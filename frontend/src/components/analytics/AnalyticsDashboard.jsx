@@ -10,6 +10,8 @@ const AnalyticsDashboard = () => {
   const [taskStatus, setTaskStatus] = useState("");
   const [result, setResult] = useState(null);
   const [message, setMessage] = useState("");
+  const [granularity, setGranularity] = useState("week");
+  const [trends, setTrends] = useState([]);
 
   // Submit performance data
   const handleSubmit = async () => {
@@ -26,10 +28,16 @@ const AnalyticsDashboard = () => {
     }
   };
 
-  // Trigger insights task
+  // Fetch insights; they come back directly unless the user's summary is still being built
   const handleGenerateInsights = async () => {
     try {
       const res = await axios.get(`/analytics/insights/${username}`);
+      if (res.data.status === "Completed") {
+        setTaskId(null);
+        setTaskStatus("Completed");
+        setResult(res.data.result);
+        return;
+      }
       setTaskId(res.data.task_id);
       setTaskStatus("Processing...");
       setResult(null);
@@ -51,6 +59,16 @@ const AnalyticsDashboard = () => {
     }
   };
 
+  // Load score trends, read from the pre-aggregated rollups
+  const handleLoadTrends = async () => {
+    try {
+      const res = await axios.get(`/analytics/trends/${username}`, { params: { granularity } });
+      setTrends(res.data.trends);
+    } catch (err) {
+      setMessage("Failed to load trends");
+    }
+  };
+
   return (
     <div style={{ padding: "20px" }}>
       <h2>Analytics Dashboard</h2>
@@ -86,7 +104,7 @@ const AnalyticsDashboard = () => {
       <button onClick={handleSubmit}>Submit</button>
 
       <h3>Generate Insights</h3>
-      <button onClick={handleGenerateInsights}>Start Task</button>
+      <button onClick={handleGenerateInsights}>Get Insights</button>
       {taskId && (
         <div>
           <p>Task ID: {taskId}</p>
@@ -106,6 +124,36 @@ const AnalyticsDashboard = () => {
         </div>
       )}
 
+      <h3>Trends</h3>
+      <select value={granularity} onChange={(e) => setGranularity(e.target.value)}>
+        <option value="hour">Hourly</option>
+        <option value="day">Daily</option>
+        <option value="week">Weekly</option>
+      </select>
+      <button onClick={handleLoadTrends}>Load Trends</button>
+      {trends.length > 0 && (
+        <table>
+          <thead>
+            <tr>
+              <th>Period</th>
+              <th>Subject</th>
+              <th>Attempts</th>
+              <th>Average Score</th>
+            </tr>
+          </thead>
+          <tbody>
+            {trends.map((t) => (
+              <tr key={`${t.bucket}-${t.subject}`}>
+                <td>{new Date(t.bucket).toLocaleString()}</td>
+                <td>{t.subject}</td>
+                <td>{t.attempts}</td>
+                <td>{t.average_score}</td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      )}
+
       {message && <p>{message}</p>}
     </div>
   );
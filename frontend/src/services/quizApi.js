@@ -45,9 +45,10 @@ export const quizApi = {
         return api.post('/quiz/submit-quiz', quizResult);
     },
 
-    // Get feedback status
-    getFeedbackStatus: (taskId) => {
-        return api.get(`/quiz/feedback-status/${taskId}`);
+    // Get feedback status, holding the request open for up to `wait` seconds until it is ready
+    getFeedbackStatus: (taskId, wait = 0) => {
+        const query = wait > 0 ? `?wait=${wait}` : '';
+        return api.get(`/quiz/feedback-status/${taskId}${query}`);
     },
 
     // Get all quiz results for a user